@@ -0,0 +1,84 @@
+from typing import Iterable, Optional, Tuple
+
+from simulation import SimulationEngine
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+BED_FIELDS = ("DepartmentAssignments", "AllBedAssignments")
+QUEUE_FIELDS = ("PatientQueue",)
+
+if pa is not None:
+    dictionary_string = pa.dictionary(pa.int32(), pa.string())
+    personnel_map = pa.map_(pa.string(), pa.string())
+    BED_SCHEMA = pa.schema(
+        [
+            ("bed_id", pa.int64()),
+            ("department", dictionary_string),
+            ("patient_id", pa.int64()),
+            ("patient_name", pa.string()),
+            ("medical_procedure", dictionary_string),
+            ("pesel", pa.string()),
+            ("nationality", dictionary_string),
+            ("days_of_stay", pa.int64()),
+            ("personnel", personnel_map),
+        ]
+    )
+    QUEUE_SCHEMA = pa.schema(
+        [
+            ("place_in_queue", pa.int64()),
+            ("patient_id", pa.int64()),
+            ("patient_name", pa.string()),
+            ("pesel", pa.string()),
+            ("nationality", dictionary_string),
+            ("admission_day", pa.int64()),
+            ("days_of_stay", pa.int64()),
+            ("medical_procedure", dictionary_string),
+            ("department", dictionary_string),
+            ("personnel", personnel_map),
+        ]
+    )
+
+
+def accepts_arrow(accept: Optional[str]) -> bool:
+    """
+    :param accept: Value of the Accept header.
+    :return: Whether the client asked for an Arrow IPC stream.
+    """
+    return bool(accept) and ARROW_STREAM_MEDIA_TYPE in accept
+
+
+def write_stream(rows: Iterable[dict], schema: "pa.Schema") -> bytes:
+    """
+    :param rows: Rows of the table, with keys named like the schema fields.
+    :param schema: Arrow schema of the table.
+    :return: Arrow IPC stream with a single record batch.
+    """
+    table = pa.Table.from_pylist(list(rows), schema=schema)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def dump_arrow_stream(engine: SimulationEngine, fields: Tuple[str, ...]) -> bytes:
+    """
+    Serializes the beds or the queue of the current day of the engine as an Arrow IPC stream. Beds are listed once
+    with their department name, repeated strings are dictionary-encoded.
+    :param engine: Simulation engine synced to the requested state.
+    :param fields: BED_FIELDS for beds or QUEUE_FIELDS for the queue.
+    :return: Arrow IPC stream.
+    """
+    if fields == QUEUE_FIELDS:
+        return write_stream(engine.iter_queue_table(), QUEUE_SCHEMA)
+
+    def iter_beds():
+        for bed_id, department_id in engine.data.bed_departments.items():
+            assignment = engine.get_bed_assignment(bed_id)
+            assignment["department"] = engine.data.departments[department_id]
+            yield assignment
+
+    return write_stream(iter_beds(), BED_SCHEMA)
@@ -0,0 +1,60 @@
+from typing import Any, Dict, List
+
+CHANGES_TABLE_FIELDS = ("AllBedAssignments", "PatientQueue", "NoShows", "Statistics", "ReplacementData")
+
+
+def get_series_changes(old: Dict[str, list], new: Dict[str, list]) -> Dict[str, Any]:
+    """
+    :param old: Series of the old state, e.g. {"Date": [...], "Occupancy": [...]}.
+    :param new: Same series of the new state.
+    :return: Number of points of the old series to keep and the points of the new one following them.
+    """
+    keep = min(len(values) for values in (*old.values(), *new.values()))
+    for name, values in new.items():
+        old_values = old[name]
+        for index in range(keep):
+            if values[index] != old_values[index]:
+                keep = index
+                break
+    return {"Keep": keep, **{name: values[keep:] for name, values in new.items()}}
+
+
+def get_table_changes(
+    old: Dict[str, Any], new: Dict[str, Any], old_positions: List[int], new_positions: List[int]
+) -> Dict[str, Any]:
+    """
+    Compares tables of two states built by the simulation engine with CHANGES_TABLE_FIELDS.
+    Queue entries are matched by their original position in the queue, the place in queue of every entry after
+    a removed one changes, but the entry itself does not.
+    :param old: Tables of the state the client has.
+    :param new: Tables of the current state.
+    :param old_positions: Original positions of the entries of the old queue, in order.
+    :param new_positions: Original positions of the entries of the current queue, in order.
+    :return: Beds, PatientQueue, NoShows, Statistics and ReplacementData fields of TableChanges.
+    """
+    beds = [
+        assignment
+        for old_assignment, assignment in zip(old["AllBedAssignments"], new["AllBedAssignments"])
+        if assignment != old_assignment
+    ]
+
+    old_set, new_set = set(old_positions), set(new_positions)
+    removed = [
+        entry["place_in_queue"] for position, entry in zip(old_positions, old["PatientQueue"]) if position not in new_set
+    ]
+    added = [entry for position, entry in zip(new_positions, new["PatientQueue"]) if position not in old_set]
+
+    statistics = {}
+    for name, value in new["Statistics"].items():
+        if isinstance(value, dict):
+            statistics[name] = get_series_changes(old["Statistics"][name], value)
+        elif value != old["Statistics"][name]:
+            statistics[name] = value
+
+    return {
+        "Beds": beds,
+        "PatientQueue": {"Removed": removed, "Added": added},
+        "NoShows": new["NoShows"] if new["NoShows"] != old["NoShows"] else None,
+        "Statistics": statistics,
+        "ReplacementData": new["ReplacementData"] if new["ReplacementData"] != old["ReplacementData"] else None,
+    }
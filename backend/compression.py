@@ -0,0 +1,78 @@
+import gzip
+import zlib
+from typing import Iterable, Iterator, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def get_supported_encodings() -> Tuple[str, ...]:
+    """
+    :return: Content codings the backend can produce, in order of preference.
+    """
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Picks the preferred supported content coding accepted by the client.
+    :param accept_encoding: Value of the Accept-Encoding header, e.g. "gzip, deflate, br;q=0.9".
+    :return: "br", "gzip" or None if the response should not be compressed.
+    """
+    if not accept_encoding:
+        return None
+    qualities = {}
+    for item in accept_encoding.split(","):
+        coding, _, parameters = item.strip().partition(";")
+        quality = 1.0
+        if parameters.strip().startswith("q="):
+            try:
+                quality = float(parameters.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[coding.strip().lower()] = quality
+
+    supported = get_supported_encodings()
+    accepted = [coding for coding in supported if qualities.get(coding, qualities.get("*", 0.0)) > 0]
+    if not accepted:
+        return None
+    return max(accepted, key=lambda coding: (qualities.get(coding, qualities.get("*", 0.0)), -supported.index(coding)))
+
+
+def compress(content: bytes, encoding: str) -> bytes:
+    """
+    :param content: Response body.
+    :param encoding: "br" or "gzip".
+    :return: Compressed response body.
+    """
+    if encoding == "br":
+        return brotli.compress(content, quality=BROTLI_QUALITY)
+    return gzip.compress(content, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def compress_chunks(chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+    """
+    Compresses a streamed response body chunk by chunk, so it never has to be held in memory whole.
+    :param chunks: Chunks of the response body.
+    :param encoding: "br" or "gzip".
+    :return: Chunks of the compressed response body.
+    """
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        for chunk in chunks:
+            compressed = compressor.process(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
@@ -1,30 +1,110 @@
 import os
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, TypeVar, Union
 
 from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import Session, sessionmaker
 
 load_dotenv()
 
+DB_USER = os.getenv("POSTGRES_USERNAME", "postgres")
+DB_PASSWORD = os.getenv("POSTGRES_PASSWORD", "postgres")
+DB_NAME = os.getenv("POSTGRES_NAME", "postgres")
+DB_HOST = os.getenv("POSTGRES_HOST", "db")
+DB_PORT = os.getenv("POSTGRES_PORT", "5432")
+DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+ASYNC_DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+DATABASE_ACCESS = os.getenv("DATABASE_ACCESS", "sync").lower()
 
-def get_session() -> Session:
-    """
-    Create a SQLAlchemy engine for connecting to the PostgreSQL database.
-    The connection parameters are read from environment variables.
-    If the environment variables are not set, default values are used.
-    :return:
-    """
+POOL_SIZE = int(os.getenv("POSTGRES_POOL_SIZE", "5"))
+POOL_MAX_OVERFLOW = int(os.getenv("POSTGRES_POOL_MAX_OVERFLOW", "10"))
+POOL_PRE_PING = os.getenv("POSTGRES_POOL_PRE_PING", "true").lower() == "true"
+POOL_RECYCLE = int(os.getenv("POSTGRES_POOL_RECYCLE", "1800"))
+
+try:
+    engine = create_engine(
+        DATABASE_URL,
+        pool_size=POOL_SIZE,
+        max_overflow=POOL_MAX_OVERFLOW,
+        pool_pre_ping=POOL_PRE_PING,
+        pool_recycle=POOL_RECYCLE,
+    )
+    SessionLocal = sessionmaker(bind=engine, autoflush=True, autocommit=False, future=True)
+except Exception as e:
+    print(f"Failed to connect: {e}")
+    raise
+
+async_engine = None
+AsyncSessionLocal = None
+if DATABASE_ACCESS == "async":
     try:
-        DB_USER = os.getenv("POSTGRES_USERNAME", "postgres")
-        DB_PASSWORD = os.getenv("POSTGRES_PASSWORD", "postgres")
-        DB_NAME = os.getenv("POSTGRES_NAME", "postgres")
-        DB_HOST = os.getenv("POSTGRES_HOST", "db")
-        DB_PORT = os.getenv("POSTGRES_PORT", "5432")
-        DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-
-        engine = create_engine(DATABASE_URL)
-        SessionLocal = sessionmaker(bind=engine, autoflush=True, autocommit=False, future=True)
-        return SessionLocal()
+        async_engine = create_async_engine(
+            ASYNC_DATABASE_URL,
+            pool_size=POOL_SIZE,
+            max_overflow=POOL_MAX_OVERFLOW,
+            pool_pre_ping=POOL_PRE_PING,
+            pool_recycle=POOL_RECYCLE,
+        )
+        AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=True, expire_on_commit=False)
     except Exception as e:
         print(f"Failed to connect: {e}")
         raise
+
+T = TypeVar("T")
+
+
+@contextmanager
+def session_scope() -> Iterator[Session]:
+    """
+    Provides a session that is always rolled back and closed, even if an exception is raised.
+    The backend never persists simulation changes, so nothing is committed here.
+    :return: Iterator yielding a single SQLAlchemy session.
+    """
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.rollback()
+        session.close()
+
+
+async def run_with_session(function: Callable[[Session], T]) -> T:
+    """
+    Runs database code written for a synchronous session without blocking the event loop.
+    With DATABASE_ACCESS=async it runs on an asyncpg connection of the async engine, otherwise in the threadpool
+    with a session of the psycopg2 engine. The session is always rolled back afterwards.
+    :param function: Function reading the database with the given session.
+    :return: Result of the function.
+    """
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as session:
+            try:
+                return await session.run_sync(function)
+            finally:
+                await session.rollback()
+
+    def run() -> T:
+        with session_scope() as session:
+            return function(session)
+
+    return await run_in_threadpool(run)
+
+
+def get_pool_statistics() -> Dict[str, Union[int, str]]:
+    """
+    Returns current statistics of the connection pool used by the selected database access path of this process.
+    :return: Dictionary with pool configuration and usage counters.
+    """
+    pool = async_engine.sync_engine.pool if async_engine is not None else engine.pool
+    return {
+        "database_access": DATABASE_ACCESS,
+        "pool_size": pool.size(),
+        "max_overflow": POOL_MAX_OVERFLOW,
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "status": pool.status(),
+    }
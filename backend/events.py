@@ -0,0 +1,102 @@
+import asyncio
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional
+
+from models import dump_json
+from state_store import SimulationState
+
+DAY_ADVANCED = "day_advanced"
+DAY_ROLLED_BACK = "day_rolled_back"
+SIMULATION_RESET = "simulation_reset"
+CONSENT_ADDED = "consent_added"
+CALL_COUNTED = "call_counted"
+STATE_CHANGED = "state_changed"
+
+
+def format_event(event: Dict[str, object]) -> bytes:
+    """
+    :param event: Event with "event", "version" and "day" keys.
+    :return: Event in the server-sent events format, its id is the state version.
+    """
+    return f"id: {event['version']}\nevent: {event['event']}\ndata: ".encode() + dump_json(event) + b"\n\n"
+
+
+class StateEvents:
+    """
+    Publishes state changes of simulation sessions to the clients listening on this worker. The last events of every
+    session are kept, so a client reconnecting with the last version it has seen does not miss any of them, and so are
+    the states they produced, so changes since one of those versions can be computed.
+    Must only be used from the event loop.
+    """
+
+    def __init__(self, history_size: int):
+        """
+        :param history_size: Number of last events and states kept per session.
+        """
+        self.history_size = history_size
+        self.histories: Dict[str, Deque[Dict[str, object]]] = {}
+        self.states: Dict[str, OrderedDict[int, SimulationState]] = {}
+        self.changed: Dict[str, asyncio.Event] = {}
+
+    def publish(self, session_id: str, event: str, state: SimulationState) -> None:
+        """
+        :param session_id: Id of the simulation session.
+        :param event: Type of the change, e.g. DAY_ADVANCED.
+        :param state: State after the change, it must not be modified.
+        """
+        history = self.histories.setdefault(session_id, deque(maxlen=self.history_size))
+        history.append({"event": event, "version": state.version, "day": state.day})
+        states = self.states.setdefault(session_id, OrderedDict())
+        states[state.version] = state
+        while len(states) > self.history_size:
+            states.popitem(last=False)
+        changed = self.changed.pop(session_id, None)
+        if changed is not None:
+            changed.set()
+
+    def get_events(self, session_id: str, since: int) -> Optional[List[Dict[str, object]]]:
+        """
+        :param session_id: Id of the simulation session.
+        :param since: Last state version the client has seen.
+        :return: Events with newer versions, None if some of them are no longer kept.
+        """
+        history = self.histories.get(session_id, ())
+        events = [event for event in history if event["version"] > since]
+        if events and events[0]["version"] != since + 1:
+            return None
+        return events
+
+    def get_state(self, session_id: str, version: int) -> Optional[SimulationState]:
+        """
+        :param session_id: Id of the simulation session.
+        :param version: State version.
+        :return: State of the version, None if it is no longer kept or was made by another worker.
+        """
+        if version == 0:
+            return SimulationState()
+        return self.states.get(session_id, {}).get(version)
+
+    async def wait(self, session_id: str, timeout: float) -> bool:
+        """
+        Waits until a change of the session is published.
+        :param session_id: Id of the simulation session.
+        :param timeout: Maximum number of seconds to wait.
+        :return: Whether a change was published before the timeout.
+        """
+        changed = self.changed.setdefault(session_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def discard(self, session_id: str) -> None:
+        """
+        Forgets the events of an evicted session and wakes up its listeners.
+        :param session_id: Id of the simulation session.
+        """
+        self.histories.pop(session_id, None)
+        self.states.pop(session_id, None)
+        changed = self.changed.pop(session_id, None)
+        if changed is not None:
+            changed.set()
@@ -0,0 +1,264 @@
+import bisect
+import heapq
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+
+
+class FreeBedIndex:
+    """
+    Free beds of every department kept in min-heaps, so the bed with the lowest id is always allocated first.
+    Allocation and release take O(log n), counts of free and occupied beds take O(1).
+    """
+
+    def __init__(self, bed_departments: Dict[int, int], occupied_beds: Iterable[int]):
+        """
+        :param bed_departments: Department id of every bed, keyed by bed id.
+        :param occupied_beds: Ids of beds that are taken at the start.
+        """
+        self.bed_departments = bed_departments
+        self.department_sizes: Dict[int, int] = {}
+        for department_id in bed_departments.values():
+            self.department_sizes[department_id] = self.department_sizes.get(department_id, 0) + 1
+
+        occupied = set(occupied_beds)
+        self.free_beds: Dict[int, list] = {department_id: [] for department_id in self.department_sizes}
+        for bed_id, department_id in bed_departments.items():
+            if bed_id not in occupied:
+                self.free_beds[department_id].append(bed_id)
+        for beds in self.free_beds.values():
+            heapq.heapify(beds)
+        self.free_beds_number = sum(len(beds) for beds in self.free_beds.values())
+
+    def allocate(self, department_id: int) -> int:
+        """
+        Takes the free bed with the lowest id in the department.
+        :param department_id: Department of the admitted patient.
+        :return: Id of the allocated bed.
+        :raises IndexError: If the department has no free bed.
+        """
+        bed_id = heapq.heappop(self.free_beds[department_id])
+        self.free_beds_number -= 1
+        return bed_id
+
+    def release(self, bed_id: int) -> None:
+        """
+        Returns a bed to the free pool of its department.
+        :param bed_id: Id of the released bed.
+        """
+        heapq.heappush(self.free_beds[self.bed_departments[bed_id]], bed_id)
+        self.free_beds_number += 1
+
+    def free_count(self, department_id: Optional[int] = None) -> int:
+        """
+        :param department_id: Department to count free beds in, all departments if None.
+        :return: Number of free beds.
+        """
+        if department_id is None:
+            return self.free_beds_number
+        return len(self.free_beds[department_id])
+
+    def occupied_count(self, department_id: Optional[int] = None) -> int:
+        """
+        :param department_id: Department to count occupied beds in, all departments if None.
+        :return: Number of occupied beds.
+        """
+        if department_id is None:
+            return len(self.bed_departments) - self.free_beds_number
+        return self.department_sizes[department_id] - len(self.free_beds[department_id])
+
+    def snapshot(self) -> Dict[int, Tuple[int, ...]]:
+        """
+        :return: Immutable copy of the heaps, it can be passed to restore later.
+        """
+        return {department_id: tuple(beds) for department_id, beds in self.free_beds.items()}
+
+    def restore(self, snapshot: Dict[int, Tuple[int, ...]]) -> None:
+        """
+        Brings back free beds saved with snapshot.
+        :param snapshot: Result of an earlier snapshot call.
+        """
+        self.free_beds = {department_id: list(beds) for department_id, beds in snapshot.items()}
+        self.free_beds_number = sum(len(beds) for beds in self.free_beds.values())
+
+
+class QueuePositionIndex:
+    """
+    Order-statistic index over queue entries in their original order, backed by a Fenwick tree of entries still in queue.
+    Removing an entry takes O(log n) instead of renumbering every entry behind it. The place in queue is computed
+    when it is read and matches the old numbering, where each removal moved all later entries one place forward.
+    """
+
+    def __init__(self, initial_places: List[int]):
+        """
+        :param initial_places: Place in queue of every entry before any removal, in ascending order.
+        """
+        self.initial_places = initial_places
+        self.size = len(initial_places)
+        self.in_queue = bytearray(b"\x01") * self.size
+        self._build_tree()
+
+    def _build_tree(self) -> None:
+        self.tree = [0] * (self.size + 1)
+        for i in range(1, self.size + 1):
+            self.tree[i] += self.in_queue[i - 1]
+            parent = i + (i & -i)
+            if parent <= self.size:
+                self.tree[parent] += self.tree[i]
+        self.entries_number = sum(self.in_queue)
+
+    def __len__(self) -> int:
+        return self.entries_number
+
+    def contains(self, position: int) -> bool:
+        return bool(self.in_queue[position])
+
+    def count_before(self, position: int) -> int:
+        """
+        :param position: Original position of an entry.
+        :return: Number of entries still in queue with a lower original position.
+        """
+        count = 0
+        i = position
+        while i > 0:
+            count += self.tree[i]
+            i -= i & -i
+        return count
+
+    def remove(self, position: int) -> None:
+        """
+        Removes the entry at the original position from the queue.
+        :param position: Original position of the removed entry.
+        """
+        if not self.in_queue[position]:
+            return
+        self.in_queue[position] = 0
+        self.entries_number -= 1
+        i = position + 1
+        while i <= self.size:
+            self.tree[i] -= 1
+            i += i & -i
+
+    def place_in_queue(self, position: int) -> int:
+        """
+        :param position: Original position of an entry still in queue.
+        :return: Current place in queue of the entry.
+        """
+        removed_before = position - self.count_before(position)
+        return self.initial_places[position] - removed_before
+
+    def find_kth(self, k: int) -> int:
+        """
+        :param k: Rank among entries still in queue, starting from 1.
+        :return: Original position of the k-th entry.
+        """
+        position = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            next_position = position + step
+            if next_position <= self.size and self.tree[next_position] < k:
+                position = next_position
+                k -= self.tree[next_position]
+            step >>= 1
+        return position
+
+    def find_by_place(self, place: int) -> Optional[int]:
+        """
+        :param place: Current place in queue.
+        :return: Original position of the entry at that place, or None if there is no such entry.
+        """
+        low, high = 1, self.entries_number
+        while low <= high:
+            middle = (low + high) // 2
+            position = self.find_kth(middle)
+            current_place = self.place_in_queue(position)
+            if current_place == place:
+                return position
+            if current_place < place:
+                low = middle + 1
+            else:
+                high = middle - 1
+        return None
+
+    def iter_places(self) -> Iterator[Tuple[int, int]]:
+        """
+        Walks the queue in order in O(n) without querying the tree.
+        :return: Iterator of (original position, current place in queue) pairs.
+        """
+        removed_before = 0
+        for position in range(self.size):
+            if self.in_queue[position]:
+                yield position, self.initial_places[position] - removed_before
+            else:
+                removed_before += 1
+
+    def snapshot(self) -> bytes:
+        """
+        :return: One byte per entry telling if it is still in queue, it can be passed to restore later.
+        """
+        return bytes(self.in_queue)
+
+    def restore(self, snapshot: bytes) -> None:
+        """
+        Brings back the queue saved with snapshot, the tree is rebuilt in O(n).
+        :param snapshot: Result of an earlier snapshot call.
+        """
+        self.in_queue = bytearray(snapshot)
+        self._build_tree()
+
+
+class AdmissionDayIndex:
+    """
+    Original queue positions bucketed by admission day and grouped by patient.
+    A day's arrivals are a single lookup, already ordered by place in queue.
+    Entries are never removed from the buckets, callers skip the ones that already left the queue.
+    """
+
+    def __init__(self, admission_days: List[int], patient_ids: List[int]):
+        """
+        :param admission_days: Admission day of every queue entry, in queue order.
+        :param patient_ids: Patient id of every queue entry, in queue order.
+        """
+        self.buckets: Dict[int, List[int]] = {}
+        self.patient_entries: Dict[int, List[Tuple[int, int]]] = {}
+        for position, (admission_day, patient_id) in enumerate(zip(admission_days, patient_ids)):
+            self.buckets.setdefault(admission_day, []).append(position)
+            self.patient_entries.setdefault(patient_id, []).append((admission_day, position))
+        for entries in self.patient_entries.values():
+            entries.sort()
+
+    def entries_for_day(self, admission_day: int) -> List[int]:
+        """
+        :param admission_day: Simulation day.
+        :return: Original positions of entries planned for that day, in queue order.
+        """
+        return self.buckets.get(admission_day, [])
+
+    def entries_for_patient(self, patient_id: int, from_day: int = 0) -> List[int]:
+        """
+        :param patient_id: Id of the patient.
+        :param from_day: First admission day to include.
+        :return: Original positions of the patient's entries planned for from_day or later, ordered by admission day.
+        """
+        entries = self.patient_entries.get(patient_id, [])
+        start = bisect.bisect_left(entries, (from_day, -1))
+        return [position for _, position in entries[start:]]
+
+
+class DictionaryEncoder:
+    """
+    Assigns consecutive integer codes to values in the order they are first seen.
+    """
+
+    def __init__(self):
+        self.values: List[Hashable] = []
+        self.codes: Dict[Hashable, int] = {}
+
+    def encode(self, value: Hashable) -> int:
+        """
+        :param value: Value to encode.
+        :return: Index of the value in values.
+        """
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
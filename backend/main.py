@@ -1,30 +1,55 @@
+import asyncio
 import json
 import logging.config
-import random
+import os
 import traceback
+from functools import partial
 from pathlib import Path
-from typing import Dict, List
-
-from db_operations import get_session
-from fastapi import FastAPI, Query
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar, Union
+
+from arrow_tables import ARROW_STREAM_MEDIA_TYPE, BED_FIELDS, QUEUE_FIELDS, accepts_arrow, dump_arrow_stream, pa
+from changes import CHANGES_TABLE_FIELDS, get_table_changes
+from compression import choose_encoding, compress, compress_chunks
+from db_operations import get_pool_statistics, run_with_session
+from events import (
+    CALL_COUNTED,
+    CONSENT_ADDED,
+    DAY_ADVANCED,
+    DAY_ROLLED_BACK,
+    SIMULATION_RESET,
+    STATE_CHANGED,
+    StateEvents,
+    format_event,
+)
+from fastapi import FastAPI, Header, HTTPException, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from models import (
-    Bed,
-    BedAssignment,
+    NORMALIZED_LOOKUP_FIELDS,
+    NORMALIZED_TABLE_FIELD_ADAPTERS,
+    NORMALIZED_TABLE_FIELDS,
+    TABLE_FIELDS,
+    BedAssignmentResponse,
     DataForReplacement,
-    Department,
     ListOfTables,
-    MedicalProcedure,
+    NormalizedTables,
     NoShow,
     Patient,
-    PatientQueue,
-    PersonnelMember,
-    PersonnelQueueAssignment,
+    PatientQueueResponse,
     Statistics,
-    StayPersonnelAssignment,
+    TableChanges,
+    dump_json,
+    dump_tables_json,
+    iter_dump_json,
 )
-from sqlalchemy.orm import joinedload
-
-NO_SHOW_PROBABILITY_TRUE_COUNT = 30
+from numpy_simulation import NumpySimulationEngine
+from response_cache import ResponseCache, etag_matches, get_etag
+from sessions import SessionManager, SimulationSession
+from simulation import HospitalData, SimulationEngine, load_hospital_data
+from single_flight import SingleFlight
+from sql_simulation import SqlSimulationEngine
+from sqlalchemy.orm import Session
+from state_store import InMemoryStateStore, SimulationState, SqlStateStore, StateStore, StateUpdate
 
 logger = logging.getLogger("hospital_logger")
 config_file = Path("logger_config.json")
@@ -32,528 +57,775 @@ with open(config_file) as f:
     config = json.load(f)
 logging.config.dictConfig(config)
 
+T = TypeVar("T")
+
+SIMULATION_ENGINES = {"python": SimulationEngine, "numpy": NumpySimulationEngine, "sql": SqlSimulationEngine}
+SIMULATION_ENGINE = os.getenv("SIMULATION_ENGINE", "python").lower()
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "64"))
+RESPONSE_COMPRESSION_MIN_SIZE = int(os.getenv("RESPONSE_COMPRESSION_MIN_SIZE", "1024"))
+RESPONSE_STREAMING_MIN_ROWS = int(os.getenv("RESPONSE_STREAMING_MIN_ROWS", "50000"))
+RESPONSE_VALIDATION = os.getenv("RESPONSE_VALIDATION", "fast").lower() == "strict"
+STATE_STORE = os.getenv("STATE_STORE", "memory").lower()
+STATE_STORE_URL = os.getenv("STATE_STORE_URL", "sqlite:///simulation_state.db")
+STATE_STORE_MAX_NUMBER = int(os.getenv("STATE_STORE_MAX_NUMBER", "10000"))
+STATE_STORE_IDLE_TIMEOUT = float(os.getenv("STATE_STORE_IDLE_TIMEOUT", "604800"))
+SESSIONS_MAX_NUMBER = int(os.getenv("SESSIONS_MAX_NUMBER", "100"))
+SESSIONS_IDLE_TIMEOUT = float(os.getenv("SESSIONS_IDLE_TIMEOUT", "3600"))
+SESSIONS_MAX_SIZE_IN_MB = int(os.getenv("SESSIONS_MAX_SIZE_IN_MB", "512"))
+EVENTS_HEARTBEAT_INTERVAL = float(os.getenv("EVENTS_HEARTBEAT_INTERVAL", "15"))
+EVENTS_HISTORY_SIZE = int(os.getenv("EVENTS_HISTORY_SIZE", "64"))
+DEFAULT_SESSION_ID = "default"
+TABLE_LAYOUTS = {"tables": TABLE_FIELDS, "normalized": NORMALIZED_TABLE_FIELDS}
+VARY = "Accept, Accept-Encoding"
+
 app = FastAPI()
-day_for_simulation = 1
-last_change = 1
-patients_consent_dictionary: dict[int, list[int]] = {1: []}
-calls_in_time: dict[str, list] = {"Date": [1], "CallsNumber": [0]}
+hospital_data: Optional[HospitalData] = None
+hospital_data_loading_lock = asyncio.Lock()
+state_store: StateStore = (
+    SqlStateStore(STATE_STORE_URL, STATE_STORE_MAX_NUMBER, STATE_STORE_IDLE_TIMEOUT)
+    if STATE_STORE == "sql"
+    else InMemoryStateStore(STATE_STORE_MAX_NUMBER, STATE_STORE_IDLE_TIMEOUT)
+)
+state_events = StateEvents(EVENTS_HISTORY_SIZE)
+
+
+def discard_session(session_id: str) -> None:
+    """
+    Forgets the events of a session evicted from this worker. Its state stays in the state store, so the session
+    continues from the same day and version with a new engine, clients with older versions reload the full tables.
+    States expire separately, after STATE_STORE_IDLE_TIMEOUT or when there are more than STATE_STORE_MAX_NUMBER.
+    :param session_id: Id of the simulation session.
+    """
+    state_events.discard(session_id)
+
+
+sessions = SessionManager(
+    SESSIONS_MAX_NUMBER, SESSIONS_IDLE_TIMEOUT, SESSIONS_MAX_SIZE_IN_MB * 1024 * 1024, on_evict=discard_session
+)
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE)
+tables_flight = SingleFlight()
+
+
+async def load_state(session_id: str) -> SimulationState:
+    """
+    Loads the simulation state of a session from the state store, stores backed by a database are read in the threadpool.
+    The state selected with the STATE_STORE environment variable is either kept in memory of this worker or in
+    a database shared by all workers.
+    :param session_id: Id of the simulation session.
+    :return: Current simulation state, it must not be modified.
+    """
+    sessions.get(session_id)
+    if state_store.blocking:
+        return await run_in_threadpool(state_store.load, session_id)
+    return state_store.load(session_id)
+
+
+async def update_state(session_id: str, function: StateUpdate, event: str) -> SimulationState:
+    """
+    Atomically applies an update to the simulation state of a session, a changed state gets a new version and
+    state token, so responses of the previous state are no longer served, and the change is published to the
+    listeners of the session.
+    :param session_id: Id of the simulation session.
+    :param function: Modifies the given state in place and returns whether it changed anything.
+    :param event: Type of the change published if the state changed.
+    :return: Simulation state after the update.
+    """
+    changed = False
+
+    def apply(state: SimulationState) -> bool:
+        nonlocal changed
+        changed = function(state)
+        return changed
+
+    sessions.get(session_id)
+    if state_store.blocking:
+        state = await run_in_threadpool(state_store.update, session_id, apply)
+    else:
+        state = state_store.update(session_id, apply)
+    if changed:
+        state_events.publish(session_id, event, state)
+    return state
+
+
+async def snapshot_state(session_id: str) -> Tuple[str, int, bool, Dict[int, List[int]], Dict[str, list], int]:
+    """
+    Loads the simulation state, updates replace the state instead of modifying it, so it can be computed
+    while other requests change the state.
+    :param session_id: Id of the simulation session.
+    :return: State token, day, whether the day should be logged, consents per day, calls numbers and state version.
+    """
+    state = await load_state(session_id)
+    return state.token, state.day, state.last_change == 1, state.consents, state.calls, state.version
+
+
+async def get_engine_factory() -> Callable[[], SimulationEngine]:
+    """
+    Loads the hospital data from the database on first use and keeps it in memory, it is shared by engines of all sessions.
+    The engine implementation is chosen with the SIMULATION_ENGINE environment variable, all of them give identical results.
+    :return: Function creating a new simulation engine.
+    """
+    global hospital_data
+    async with hospital_data_loading_lock:
+        if hospital_data is None:
+            hospital_data = await run_with_session(load_hospital_data)
+    return partial(SIMULATION_ENGINES[SIMULATION_ENGINE], hospital_data)
+
+
+def run_with_engine(
+    session: SimulationSession, engine_factory: Callable[[], SimulationEngine], function: Callable[[SimulationEngine], T]
+) -> T:
+    """
+    Runs a function with the engine of a session held exclusively and accounts the memory the engine takes afterwards.
+    If the function fails, the engine is dropped, so a half-updated engine is never used again.
+    Blocks, so it has to run outside of the event loop.
+    :param session: Simulation session.
+    :param engine_factory: Creates the engine if the session does not have one yet.
+    :param function: Function using the engine.
+    :return: Result of the function.
+    """
+    with session.lock:
+        try:
+            result = function(session.get_engine(engine_factory))
+        except Exception:
+            session.drop_engine()
+            raise
+        session.update_size()
+    return result
 
 
 @app.get("/get-current-day", response_model=Dict[str, int])
-def get_current_day() -> Dict[str, int]:
+async def get_current_day(session_id: str = Query(DEFAULT_SESSION_ID)) -> Dict[str, int]:
     """
     Returns the current day of the simulation as per it's state on the server to keep the frontend and backend in sync.
+    :param session_id: Id of the simulation session.
     :return: JSON object with the current day of the simulation.
     """
-    global day_for_simulation
-    return {"day": day_for_simulation}
+    state = await load_state(session_id)
+    return {"day": state.day}
 
 
 @app.get("/update-day", response_model=Dict[str, int])
-def update_day(delta: int = Query(...)) -> Dict[str, int]:
+async def update_day(delta: int = Query(...), session_id: str = Query(DEFAULT_SESSION_ID)) -> Dict[str, int]:
     """
     Updates the current day of the simulation.
     :param delta: Either -1 or 1 to signal a rollback or a forward.
-    :return: Returns the day resolved on the server side.
+    :param session_id: Id of the simulation session.
+    :return: Returns the day resolved on the server side and the state version.
     """
-    global day_for_simulation, last_change
     if delta not in (-1, 1):
         return {"error": "Invalid delta value. Use -1 or 1."}
-    if delta == 1 and day_for_simulation < 20 or delta == -1 and day_for_simulation > 1:
-        day_for_simulation += delta
-        last_change = delta
+
+    def change_day(state: SimulationState) -> bool:
+        if not (delta == 1 and state.day < 20 or delta == -1 and state.day > 1):
+            return False
+        state.day += delta
+        state.last_change = delta
         if delta == 1:
-            patients_consent_dictionary[day_for_simulation] = []
-            calls_in_time["Date"].append(day_for_simulation)
-            calls_in_time["CallsNumber"].append(0)
+            state.consents[state.day] = []
+            state.calls["Date"].append(state.day)
+            state.calls["CallsNumber"].append(0)
         else:
-            patients_consent_dictionary.pop(day_for_simulation + 1)
-            calls_in_time["Date"].pop(day_for_simulation)
-            calls_in_time["CallsNumber"].pop(day_for_simulation)
-    return {"day": day_for_simulation}
+            state.consents.pop(state.day + 1)
+            state.calls["Date"].pop(state.day)
+            state.calls["CallsNumber"].pop(state.day)
+        return True
+
+    state = await update_state(session_id, change_day, DAY_ADVANCED if delta == 1 else DAY_ROLLED_BACK)
+    return {"day": state.day, "version": state.version}
 
 
 @app.get("/reset-simulation", response_model=Dict[str, int])
-def reset_simulation() -> Dict[str, int]:
-    global patients_consent_dictionary, day_for_simulation, last_change, calls_in_time
-    day_for_simulation = 1
-    last_change = 1
-    patients_consent_dictionary = {1: []}
-    calls_in_time = {"Date": [1], "CallsNumber": [0]}
-    logger.info("Resetting the simulation")
-    return {"day": day_for_simulation}
+async def reset_simulation(session_id: str = Query(DEFAULT_SESSION_ID)) -> Dict[str, int]:
+    def reset(state: SimulationState) -> bool:
+        initial_state = SimulationState()
+        state.day = initial_state.day
+        state.last_change = initial_state.last_change
+        state.consents = initial_state.consents
+        state.calls = initial_state.calls
+        return True
+
+    state = await update_state(session_id, reset, SIMULATION_RESET)
+    logger.info(f"Resetting the simulation of session {session_id}")
+    return {"day": state.day, "version": state.version}
 
 
-@app.get("/get-tables-and-statistics", response_model=ListOfTables)
-def get_tables_and_statistics() -> ListOfTables:
+async def iter_state_events(session_id: str, since: Optional[int]) -> AsyncIterator[bytes]:
     """
-    Returns the current state of the simulation.
-    :return: A JSON object with three lists: BedAssignment, PatientQueue, and NoShows.
+    Streams state changes of a session as server-sent events until the client disconnects. Changes made by other
+    workers are not published here, so the state version is also checked with every heartbeat.
+    :param session_id: Id of the simulation session.
+    :param since: Last state version seen by the client, None to start with the current state.
+    :return: Chunks of the event stream.
     """
+    version = -1 if since is None else since
+    while True:
+        events = state_events.get_events(session_id, version)
+        if events:
+            for event in events:
+                yield format_event(event)
+            version = events[-1]["version"]
+            continue
+        if events is not None and version >= 0 and await state_events.wait(session_id, EVENTS_HEARTBEAT_INTERVAL):
+            continue
+        state = await load_state(session_id)
+        if state.version != version:
+            version = state.version
+            yield format_event({"event": STATE_CHANGED, "version": version, "day": state.day})
+        else:
+            yield b": heartbeat\n\n"
 
-    day = day_for_simulation
-    rollback_flag = last_change
-    consent_dict = patients_consent_dictionary.copy()
-    calls_numbers_dict = calls_in_time.copy()
-    occupancy_in_time = {"Date": [1], "Occupancy": [100]}
-    no_shows_in_time = {"Date": [1], "NoShows": [0], "NoShowsNumber": [0]}
-    stay_lengths = {}
 
-    def decrement_days_of_stay():
-        session.query(BedAssignment).update({BedAssignment.days_of_stay: BedAssignment.days_of_stay - 1})
+@app.get("/state-events")
+async def get_state_events(
+    session_id: str = Query(DEFAULT_SESSION_ID),
+    since: Optional[int] = Query(None),
+    last_event_id: Optional[int] = Header(None),
+) -> StreamingResponse:
+    """
+    Server-sent events of the session: day advanced or rolled back, simulation reset, consent added and call counted.
+    Every event carries the new state version and day, so clients refetch the tables only when the state changed.
+    A state_changed event is sent when the version of the client is unknown or outdated, e.g. after missed events.
+    :param session_id: Id of the simulation session.
+    :param since: Last state version seen by the client.
+    :param last_event_id: Sent by reconnecting EventSource clients, used instead of since.
+    :return: Stream of events.
+    """
+    return StreamingResponse(
+        iter_state_events(session_id, last_event_id if last_event_id is not None else since),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-    def print_patients_to_be_released(log: bool):
-        patients_to_release = (
-            session.query(Patient)
-            .filter(Patient.patient_id.in_(session.query(BedAssignment.patient_id).filter(BedAssignment.days_of_stay <= 0)))
-            .all()
-        )
-        if log and patients_to_release:
-            logger.info(
-                "Patients to be released from hospital:\n"
-                + "\n".join(f"Patient ID: {p.patient_id}, Name: {p.first_name} {p.last_name}" for p in patients_to_release)
-            )
 
-    def delete_patients_to_be_released():
-        session.query(BedAssignment).filter(BedAssignment.days_of_stay <= 0).delete(synchronize_session=False)
-
-    def assign_bed_to_patient(bed_id: int, patient_id: int, procedure_id: int, days: int, personnel: list, log: bool):
-        assignment = BedAssignment(bed_id=bed_id, patient_id=patient_id, procedure_id=procedure_id, days_of_stay=days)
-        session.add(assignment)
-        for personnel_member in personnel:
-            session.add(StayPersonnelAssignment(bed_id=bed_id, member_id=personnel_member.member_id))
-        if log:
-            logger.info(f"Assigned bed {bed_id} to patient {patient_id} for {days} days")
-
-    def check_if_patient_has_bed(patient_id: int) -> bool:
-        return session.query(BedAssignment).filter_by(patient_id=patient_id).first() is not None
-
-    def delete_patient_by_queue_id_from_queue(queue_id: int):
-        entry = (
-            session.query(PatientQueue)
-            .filter_by(queue_id=queue_id)
-            .options(joinedload(PatientQueue.personnel_queue_assignment))
-            .first()
+def get_selected_fields(fields: Optional[str], layout: str = "tables") -> Tuple[str, ...]:
+    """
+    :param fields: Comma separated names of fields, None selects all of them.
+    :param layout: "tables" for fields of ListOfTables or "normalized" for fields of NormalizedTables.
+    :return: Selected field names in the order of the layout's fields.
+    """
+    if layout not in TABLE_LAYOUTS:
+        raise HTTPException(status_code=400, detail=f"Unknown layout: {layout}. Use {', '.join(TABLE_LAYOUTS)}.")
+    layout_fields = TABLE_LAYOUTS[layout]
+    if fields is None:
+        return layout_fields
+    selected = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = selected.difference(layout_fields)
+    if unknown or not selected:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}. Use {', '.join(layout_fields)}."
         )
-        if entry:
-            for assignment in entry.personnel_queue_assignment:
-                session.delete(assignment)
-            session.delete(entry)
+    if layout == "normalized" and selected.intersection(("Beds", "PatientQueue")):
+        selected.update(NORMALIZED_LOOKUP_FIELDS)
+    return tuple(name for name in layout_fields if name in selected)
 
-            session.query(PatientQueue).filter(PatientQueue.queue_id > queue_id).update(
-                {PatientQueue.queue_id: PatientQueue.queue_id - 1}, synchronize_session="fetch"
-            )
 
-    def get_patient_name_by_id(patient_id: int) -> str:
-        patient = session.query(Patient).filter_by(patient_id=patient_id).first()
-        return f"{patient.first_name} {patient.last_name}" if patient else "Unknown"
-
-    def get_beds_number() -> int:
-        return session.query(Bed).count()
-
-    def calculate_average_in_dictionary(data: dict) -> float:
-        total_sum = sum(sum(v) for v in data.values() if isinstance(v, list))
-        total_items_number = sum(len(v) for v in data.values() if isinstance(v, list))
-        return total_sum / total_items_number
-
-    def calculate_statistics() -> Statistics:
-        # Calculation of average length of stay
-        avg_stay_length = calculate_average_in_dictionary(stay_lengths)
-        if len(stay_lengths) != 1:
-            max_key = max(stay_lengths.keys())
-            stay_lengths.pop(max_key)
-            avg_stay_length_diff = avg_stay_length - calculate_average_in_dictionary(stay_lengths)
-        else:
-            avg_stay_length_diff = "No previous day"
+def get_arrow_layout(accept: Optional[str]) -> str:
+    """
+    :param accept: Value of the Accept header.
+    :return: "arrow" if the client asked for an Arrow IPC stream, otherwise "tables".
+    """
+    if not accepts_arrow(accept):
+        return "tables"
+    if pa is None:
+        raise HTTPException(status_code=406, detail="Arrow responses need pyarrow installed on the server.")
+    return "arrow"
 
-        # Hospital occupancy calculations
-        occupancy_data = occupancy_in_time["Occupancy"].copy()
 
-        if len(occupancy_data) != 1:
-            occupancy = occupancy_data[-1]
-            occupancy_diff = occupancy_data[-1] - occupancy_data[-2]
+def get_response_key(token: str, layout: str, fields: Tuple[str, ...]) -> str:
+    """
+    :param token: State token of the response.
+    :param layout: Layout of the response, "tables", "normalized" or "arrow".
+    :param fields: Selected field names.
+    :return: Key of the response in the response cache, the full response is keyed by the state token alone.
+    """
+    return token if layout == "tables" and fields == TABLE_FIELDS else "-".join((token, layout, *fields))
+
+
+def compute_tables_content(
+    engine: SimulationEngine,
+    key: str,
+    layout: str,
+    fields: Tuple[str, ...],
+    day: int,
+    consent_dict: Dict[int, List[int]],
+    calls_numbers_dict: Dict[str, list],
+    log: bool,
+) -> bytes:
+    """
+    Computes the serialized response of a state and stores it in the response cache.
+    :param engine: Simulation engine to compute the state with.
+    :param key: Key of the response in the response cache.
+    :param layout: Layout of the response, "tables", "normalized" or "arrow".
+    :param fields: Names of the layout's fields included in the response.
+    :param day: Simulation day of the state.
+    :param consent_dict: Place in queue of patients who agreed to come earlier, per simulation day.
+    :param calls_numbers_dict: Number of phone calls made per simulation day.
+    :param log: Whether to log the events of the day.
+    :return: Response serialized to JSON.
+    """
+    content = response_cache.peek(key)
+    if content is not None:
+        return content
+
+    engine.sync(day, consent_dict, log=log)
+    if layout == "arrow":
+        content = dump_arrow_stream(engine, fields)
+    elif layout == "normalized":
+        values = engine.get_normalized_table_fields(fields, consent_dict, calls_numbers_dict)
+        content = dump_tables_json(values, NORMALIZED_TABLE_FIELD_ADAPTERS, validate=RESPONSE_VALIDATION)
+    else:
+        values = engine.get_table_fields(fields, consent_dict, calls_numbers_dict)
+        content = dump_tables_json(values, validate=RESPONSE_VALIDATION)
+    response_cache.put(key, content)
+    return content
+
+
+def compress_content(key: str, content: bytes, encoding: str) -> bytes:
+    """
+    Compresses a response and stores it in the response cache next to the uncompressed one.
+    :param key: Key of the uncompressed response in the response cache.
+    :param content: Uncompressed response.
+    :param encoding: "br" or "gzip".
+    :return: Compressed response.
+    """
+    encoded_key = f"{key}-{encoding}"
+    compressed = response_cache.peek(encoded_key)
+    if compressed is None:
+        compressed = compress(content, encoding)
+        response_cache.put(encoded_key, compressed)
+    return compressed
+
+
+def iter_tables_content(
+    session: SimulationSession,
+    engine_factory: Callable[[], SimulationEngine],
+    fields: Tuple[str, ...],
+    day: int,
+    consent_dict: Dict[int, List[int]],
+    calls_numbers_dict: Dict[str, list],
+    log: bool,
+    encoding: Optional[str],
+) -> Iterator[bytes]:
+    """
+    Serializes the response row by row while the engine of the session is held, without building all rows first.
+    The response is not cached, it is only used for responses too large to keep.
+    :param session: Simulation session.
+    :param engine_factory: Creates the engine if the session does not have one yet.
+    :param fields: Names of ListOfTables fields included in the response.
+    :param day: Simulation day of the state.
+    :param consent_dict: Place in queue of patients who agreed to come earlier, per simulation day.
+    :param calls_numbers_dict: Number of phone calls made per simulation day.
+    :param log: Whether to log the events of the day.
+    :param encoding: "br", "gzip" or None for an uncompressed response.
+    :return: Chunks of the response.
+    """
+    with session.lock:
+        try:
+            engine = session.get_engine(engine_factory)
+            engine.sync(day, consent_dict, log=log)
+            chunks = iter_dump_json(engine.iter_table_fields(fields, consent_dict, calls_numbers_dict))
+            yield from compress_chunks(chunks, encoding) if encoding else chunks
+            session.update_size()
+        except Exception as e:
+            logger.error(f"Error occurred while streaming: {str(e)}\n{traceback.format_exc()}")
+            session.drop_engine()
+            raise
+
+
+def get_rows_number(data: HospitalData, fields: Tuple[str, ...]) -> int:
+    """
+    :param data: Hospital data.
+    :param fields: Names of ListOfTables fields included in the response.
+    :return: Upper bound of the number of bed and queue rows in the response.
+    """
+    beds_fields_number = len({"DepartmentAssignments", "AllBedAssignments"}.intersection(fields))
+    return beds_fields_number * len(data.bed_departments) + ("PatientQueue" in fields) * len(data.queue)
+
 
-            avg_occupancy = sum(occupancy_data) / len(occupancy_data)
-            occupancy_data.pop(-1)
-            avg_occupancy_diff = avg_occupancy - (sum(occupancy_data) / len(occupancy_data))
-        else:
-            occupancy = occupancy_data[0]
-            occupancy_diff = "No previous day"
+def get_not_modified_response(
+    key: str, encoding: Optional[str], if_none_match: Optional[str], headers: Dict[str, str]
+) -> Optional[Response]:
+    """
+    :param key: Key of the uncompressed response in the response cache.
+    :param encoding: "br", "gzip" or None for an uncompressed response.
+    :param if_none_match: ETag of the response the client already has.
+    :param headers: Headers of the response.
+    :return: Empty 304 response if the client has the response, either uncompressed or compressed, otherwise None.
+    """
+    for current_etag in (get_etag(key), get_etag(f"{key}-{encoding}") if encoding else None):
+        if current_etag and etag_matches(if_none_match, current_etag):
+            return Response(status_code=304, headers={**headers, "ETag": current_etag})
+    return None
 
-            avg_occupancy = occupancy_data[0]
-            avg_occupancy_diff = "No previous day"
 
-        # No-shows calculations
-        no_shows_data = no_shows_in_time["NoShows"].copy()
+async def get_content_response(
+    key: str, content: bytes, media_type: str, encoding: Optional[str], headers: Dict[str, str]
+) -> Response:
+    """
+    Responses of at least RESPONSE_COMPRESSION_MIN_SIZE bytes are compressed if the client accepts it.
+    :param key: Key of the uncompressed response in the response cache.
+    :param content: Uncompressed response.
+    :param media_type: Media type of the response.
+    :param encoding: "br", "gzip" or None for an uncompressed response.
+    :param headers: Headers of the response.
+    :return: Response with its ETag.
+    """
+    if encoding is None or len(content) < RESPONSE_COMPRESSION_MIN_SIZE:
+        return Response(content=content, media_type=media_type, headers={**headers, "ETag": get_etag(key)})
+
+    encoded_key = f"{key}-{encoding}"
+    compressed = response_cache.peek(encoded_key)
+    if compressed is None:
+        compressed = await tables_flight.do_async(encoded_key, lambda: compress_content(key, content, encoding))
+    headers = {**headers, "ETag": get_etag(encoded_key), "Content-Encoding": encoding}
+    return Response(content=compressed, media_type=media_type, headers=headers)
+
+
+async def get_tables_response(
+    session_id: str,
+    fields: Tuple[str, ...],
+    if_none_match: Optional[str],
+    layout: str = "tables",
+    accept_encoding: Optional[str] = None,
+) -> Response:
+    """
+    Serialized responses are cached by state token and selected fields, so polling an unchanged state does not compute
+    it again. Sessions in the same state share the cached response.
+    The cache key is also sent as ETag, a client sending it back in If-None-Match gets an empty 304 response.
+    Concurrent requests for the same response wait for a single computation instead of each running their own.
+    Cached and unchanged responses are served on the event loop, computations run in the threadpool.
+    Responses of at least RESPONSE_COMPRESSION_MIN_SIZE bytes are compressed with brotli or gzip if the client accepts
+    it, compressed responses are cached too. Responses with more than RESPONSE_STREAMING_MIN_ROWS bed and queue rows
+    are streamed instead of being built and cached whole.
+    :param session_id: Id of the simulation session.
+    :param fields: Names of the layout's fields included in the response.
+    :param if_none_match: ETag of the response the client already has.
+    :param layout: Layout of the response, "tables", "normalized" or "arrow" for an Arrow IPC stream of beds or queue.
+    :param accept_encoding: Value of the Accept-Encoding header.
+    :return: JSON object with the selected fields, the state version is sent in the X-State-Version header.
+    """
+    token, day, log, consent_dict, calls_numbers_dict, version = await snapshot_state(session_id)
+    key = get_response_key(token, layout, fields)
+    encoding = choose_encoding(accept_encoding)
+    media_type = ARROW_STREAM_MEDIA_TYPE if layout == "arrow" else "application/json"
+    headers = {"Vary": VARY, "X-State-Version": str(version)}
 
-        if len(no_shows_data) != 1:
-            no_shows_perc = no_shows_data[-1]
-            no_shows_perc_diff = (
-                no_shows_data[-1] - no_shows_data[-2]
-                if no_shows_data[-1] != "No incoming patients" and no_shows_data[-2] != "No incoming patients"
-                else "No incoming patients"
-            )
+    not_modified = get_not_modified_response(key, encoding, if_none_match, headers)
+    if not_modified is not None:
+        return not_modified
 
-            total_sum = sum(x for x in no_shows_data if x != "No incoming patients")
-            items_number = sum(1 for x in no_shows_data if x != "No incoming patients")
-            avg_no_shows_perc = total_sum / items_number if items_number != 0 else "No incoming patients"
-            no_shows_data.pop(-1)
-
-            total_sum = sum(x for x in no_shows_data if x != "No incoming patients")
-            items_number = sum(1 for x in no_shows_data if x != "No incoming patients")
-            avg_no_shows_perc_diff = (
-                avg_no_shows_perc - (total_sum / items_number)
-                if items_number != 0 and avg_no_shows_perc != "No incoming patients"
-                else "No incoming patients"
+    try:
+        session = sessions.get(session_id)
+        engine_factory = await get_engine_factory()
+        if layout == "tables" and get_rows_number(hospital_data, fields) > RESPONSE_STREAMING_MIN_ROWS:
+            headers["ETag"] = get_etag(f"{key}-{encoding}" if encoding else key)
+            if encoding:
+                headers["Content-Encoding"] = encoding
+            content_chunks = iter_tables_content(
+                session, engine_factory, fields, day, consent_dict, calls_numbers_dict, log, encoding
             )
-        else:
-            no_shows_perc = no_shows_data[0]
-            no_shows_perc_diff = "No previous day"
-
-            avg_no_shows_perc = no_shows_data[0]
-            avg_no_shows_perc_diff = "No previous day"
-
-        # Calls calculations
-        percentage_list = []
-        for i in range(len(calls_numbers_dict["CallsNumber"])):
-            if calls_numbers_dict["CallsNumber"][i] != 0:
-                percentage_list.append(len(consent_dict[i + 1]) / calls_numbers_dict["CallsNumber"][i] * 100)
-            else:
-                percentage_list.append("No calls made")
-
-        consent_percentage = percentage_list[-1]
-        consent_percentage_diff = (
-            percentage_list[-1] - percentage_list[-2]
-            if percentage_list[-1] != "No calls made" and percentage_list[-2] != "No calls made"
-            else "No calls made"
-        )
+            return StreamingResponse(content_chunks, media_type="application/json", headers=headers)
+
+        content = response_cache.get(key)
+        if content is None:
+            content = await tables_flight.do_async(
+                key,
+                lambda: run_with_engine(
+                    session,
+                    engine_factory,
+                    lambda engine: compute_tables_content(
+                        engine, key, layout, fields, day, consent_dict, calls_numbers_dict, log
+                    ),
+                ),
+            )
+        return await get_content_response(key, content, media_type, encoding, headers)
 
-        total_sum = sum(x for x in percentage_list if x != "No calls made")
-        items_number = sum(1 for x in percentage_list if x != "No calls made")
-        avg_consent_perc = total_sum / items_number if items_number != 0 else "No calls made"
+    except Exception as e:
+        error_message = f"Error occurred: {str(e)}\n{traceback.format_exc()}"
+        logger.error(error_message)
+        return {"error": "Server Error", "message": error_message}
 
-        percentage_list.pop(-1)
 
-        total_sum = sum(x for x in percentage_list if x != "No calls made")
-        items_number = sum(1 for x in percentage_list if x != "No calls made")
-        avg_consent_perc_diff = (
-            avg_consent_perc - (total_sum / items_number)
-            if items_number != 0 and avg_consent_perc != "No calls made"
-            else "No calls made"
-        )
+@app.get("/get-tables-and-statistics", response_model=Union[ListOfTables, NormalizedTables])
+async def get_tables_and_statistics(
+    session_id: str = Query(DEFAULT_SESSION_ID),
+    fields: Optional[str] = Query(None),
+    layout: str = Query("tables"),
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+) -> Union[ListOfTables, NormalizedTables]:
+    """
+    Returns the current state of the simulation.
+    :param session_id: Id of the simulation session.
+    :param fields: Comma separated names of fields to return, e.g. "Statistics,NoShows". All fields by default.
+    :param layout: "tables" for ListOfTables or "normalized" for NormalizedTables, which lists every bed once and
+        sends departments, procedures and personnel as lookup tables referenced by index.
+    :param if_none_match: ETag of the response the client already has.
+    :param accept_encoding: Content codings accepted by the client.
+    :return: A JSON object with beds per department and all beds, PatientQueue, NoShows, Statistics and ReplacementData.
+    """
+    selected_fields = get_selected_fields(fields, layout)
+    return await get_tables_response(session_id, selected_fields, if_none_match, layout, accept_encoding)
 
-        return Statistics(
-            OccupancyInTime=occupancy_in_time,
-            Occupancy=f"{occupancy:.3f}".rstrip("0").rstrip(".") + "%",
-            OccupancyDifference=f"{occupancy_diff:.3f}".rstrip("0").rstrip(".") + "%"
-            if occupancy_diff != "No previous day"
-            else "No previous day",
-            AverageOccupancy=f"{avg_occupancy:.3f}".rstrip("0").rstrip(".") + "%",
-            AverageOccupancyDifference=f"{avg_occupancy_diff:.3f}".rstrip("0").rstrip(".") + "%"
-            if avg_occupancy_diff != "No previous day"
-            else "No previous day",
-            AverageStayLength=f"{avg_stay_length:.3f}".rstrip("0").rstrip("."),
-            AverageStayLengthDifference=f"{avg_stay_length_diff:.3f}".rstrip("0").rstrip(".")
-            if avg_stay_length_diff != "No previous day"
-            else "No previous day",
-            NoShowsInTime={"Date": no_shows_in_time["Date"], "NoShowsNumber": no_shows_in_time["NoShowsNumber"]},
-            NoShowsPercentage=f"{no_shows_perc:.3f}".rstrip("0").rstrip(".") + "%"
-            if no_shows_perc != "No incoming patients"
-            else "No incoming patients",
-            NoShowsPercentageDifference=f"{no_shows_perc_diff:.3f}".rstrip("0").rstrip(".") + "%"
-            if no_shows_perc_diff != "No incoming patients" and no_shows_perc_diff != "No previous day"
-            else no_shows_perc_diff,
-            AverageNoShowsPercentage=f"{avg_no_shows_perc:.3f}".rstrip("0").rstrip(".") + "%"
-            if avg_no_shows_perc != "No incoming patients"
-            else "No incoming patients",
-            AverageNoShowsPercentageDifference=f"{avg_no_shows_perc_diff:.3f}".rstrip("0").rstrip(".") + "%"
-            if avg_no_shows_perc_diff != "No incoming patients" and avg_no_shows_perc_diff != "No previous day"
-            else avg_no_shows_perc_diff,
-            CallsInTime=calls_numbers_dict,
-            ConsentsPercentage=f"{consent_percentage:.3f}".rstrip("0").rstrip(".") + "%"
-            if consent_percentage != "No calls made"
-            else "No calls made",
-            ConsentsPercentageDifference=f"{consent_percentage_diff:.3f}".rstrip("0").rstrip(".") + "%"
-            if consent_percentage_diff != "No calls made"
-            else "No calls made",
-            AverageConstentsPercentage=f"{avg_consent_perc:.3f}".rstrip("0").rstrip(".") + "%"
-            if avg_consent_perc != "No calls made"
-            else "No calls made",
-            AverageConstentsPercentageDifference=f"{avg_consent_perc_diff:.3f}".rstrip("0").rstrip(".") + "%"
-            if avg_consent_perc_diff != "No calls made"
-            else "No calls made",
-        )
 
-    try:
-        rnd = random.Random()
-        rnd.seed(43)
-        session = get_session()
+@app.get("/get-beds")
+async def get_beds(
+    session_id: str = Query(DEFAULT_SESSION_ID),
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+) -> Dict[str, Union[Dict[str, List[BedAssignmentResponse]], List[BedAssignmentResponse]]]:
+    """
+    Returns bed assignments of the current state of the simulation.
+    :param session_id: Id of the simulation session.
+    :param accept: Media types accepted by the client, application/vnd.apache.arrow.stream selects an Arrow IPC stream.
+    :param if_none_match: ETag of the response the client already has.
+    :param accept_encoding: Content codings accepted by the client.
+    :return: A JSON object with DepartmentAssignments and AllBedAssignments, or an Arrow IPC stream with every bed
+        once and its department.
+    """
+    layout = get_arrow_layout(accept)
+    return await get_tables_response(session_id, BED_FIELDS, if_none_match, layout, accept_encoding)
 
-        stay_lengths[1] = [d[0] for d in session.query(BedAssignment.days_of_stay).all()]
 
-        beds_number = get_beds_number()
+@app.get("/get-queue")
+async def get_queue(
+    session_id: str = Query(DEFAULT_SESSION_ID),
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+) -> Dict[str, List[PatientQueueResponse]]:
+    """
+    Returns the patient queue of the current state of the simulation.
+    :param session_id: Id of the simulation session.
+    :param accept: Media types accepted by the client, application/vnd.apache.arrow.stream selects an Arrow IPC stream.
+    :param if_none_match: ETag of the response the client already has.
+    :param accept_encoding: Content codings accepted by the client.
+    :return: A JSON object with PatientQueue or an Arrow IPC stream of the queue.
+    """
+    layout = get_arrow_layout(accept)
+    return await get_tables_response(session_id, QUEUE_FIELDS, if_none_match, layout, accept_encoding)
 
-        if rollback_flag == 1:
-            logger.info(f"Current simulation day: {day}")
-        else:
-            logger.info(f"Rollback of simulation to day {day}")
 
-        no_shows_list: List[NoShow] = []
+def compute_changes_content(
+    engine: SimulationEngine, key: str, since_state: SimulationState, state: SimulationState, log: bool
+) -> bytes:
+    """
+    Computes the changes between two states and stores them in the response cache. The engine is moved to the old
+    state first, clients usually ask for changes since the state the engine is already in.
+    :param engine: Simulation engine to compute the states with.
+    :param key: Key of the response in the response cache.
+    :param since_state: State the client has.
+    :param state: Current state.
+    :param log: Whether to log the events of the current day.
+    :return: TableChanges serialized to JSON.
+    """
+    content = response_cache.peek(key)
+    if content is not None:
+        return content
+
+    engine.sync(since_state.day, since_state.consents, log=False)
+    since_tables = engine.get_table_fields(CHANGES_TABLE_FIELDS, since_state.consents, since_state.calls)
+    since_positions = [position for position, _ in engine.queue_index.iter_places()]
+    engine.sync(state.day, state.consents, log=log)
+    tables = engine.get_table_fields(CHANGES_TABLE_FIELDS, state.consents, state.calls)
+    positions = [position for position, _ in engine.queue_index.iter_places()]
+    changes = {"Since": since_state.version, "Version": state.version, "Day": state.day}
+    changes.update(get_table_changes(since_tables, tables, since_positions, positions))
+    content = TableChanges(**changes).model_dump_json().encode() if RESPONSE_VALIDATION else dump_json(changes)
+    response_cache.put(key, content)
+    return content
+
+
+@app.get("/changes", response_model=TableChanges)
+async def get_changes(
+    since: int = Query(...),
+    session_id: str = Query(DEFAULT_SESSION_ID),
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+) -> TableChanges:
+    """
+    Returns only what changed since a state version: changed beds, removed and added queue entries and new points
+    of the statistics series, so clients patch the tables they have instead of fetching them again.
+    Versions are taken from the X-State-Version header of table responses or from state events. The last
+    EVENTS_HISTORY_SIZE states of a session made by this worker are kept, older versions get 410 and the client
+    has to fetch the tables again.
+    :param since: State version of the tables the client has.
+    :param session_id: Id of the simulation session.
+    :param if_none_match: ETag of the response the client already has.
+    :param accept_encoding: Content codings accepted by the client.
+    :return: TableChanges from the given version to the current one.
+    """
+    state = await load_state(session_id)
+    since_state = state if since == state.version else state_events.get_state(session_id, since)
+    if since_state is None:
+        raise HTTPException(status_code=410, detail=f"State version {since} is no longer available, fetch the tables again.")
+
+    key = "-".join((since_state.token, state.token, "changes", str(since), str(state.version)))
+    encoding = choose_encoding(accept_encoding)
+    headers = {"Vary": "Accept-Encoding", "X-State-Version": str(state.version)}
+    not_modified = get_not_modified_response(key, encoding, if_none_match, headers)
+    if not_modified is not None:
+        return not_modified
+
+    content = response_cache.get(key)
+    if content is None:
+        session = sessions.get(session_id)
+        engine_factory = await get_engine_factory()
+        log = state.last_change == 1
+        content = await tables_flight.do_async(
+            key,
+            lambda: run_with_engine(
+                session, engine_factory, lambda engine: compute_changes_content(engine, key, since_state, state, log)
+            ),
+        )
+    return await get_content_response(key, content, "application/json", encoding, headers)
 
-        days_of_stay_for_replacement: List[int] = []
-        personnels_for_replacement: List[Dict[str, str]] = []
-        departments_for_replacement: List[str] = []
 
-        for iteration in range(day - 1):
-            should_log = iteration == day - 2 and rollback_flag == 1
-            should_give_no_shows = iteration == day - 2
+@app.get("/get-no-shows")
+async def get_no_shows(
+    session_id: str = Query(DEFAULT_SESSION_ID),
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+) -> Dict[str, List[NoShow]]:
+    """
+    Returns no-shows of the current day of the simulation.
+    :param session_id: Id of the simulation session.
+    :param if_none_match: ETag of the response the client already has.
+    :param accept_encoding: Content codings accepted by the client.
+    :return: A JSON object with NoShows.
+    """
+    return await get_tables_response(session_id, ("NoShows",), if_none_match, accept_encoding=accept_encoding)
 
-            decrement_days_of_stay()
-            print_patients_to_be_released(log=should_log)
-            delete_patients_to_be_released()
 
-            assigned_beds = session.query(BedAssignment.bed_id).scalar_subquery()
-            beds = (
-                session.query(Bed.department_id, Bed.bed_id)
-                .filter(~Bed.bed_id.in_(assigned_beds))
-                .order_by(Bed.department_id, Bed.bed_id)
-                .all()
-            )
+@app.get("/get-statistics")
+async def get_statistics(
+    session_id: str = Query(DEFAULT_SESSION_ID),
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+) -> Dict[str, Statistics]:
+    """
+    Returns statistics of the current state of the simulation, without serializing the bed and queue tables.
+    :param session_id: Id of the simulation session.
+    :param if_none_match: ETag of the response the client already has.
+    :param accept_encoding: Content codings accepted by the client.
+    :return: A JSON object with Statistics.
+    """
+    return await get_tables_response(session_id, ("Statistics",), if_none_match, accept_encoding=accept_encoding)
 
-            bed_map = {}
-            for department_id, bed_id in beds:
-                if department_id not in bed_map:
-                    bed_map[department_id] = []
-                bed_map[department_id].append(bed_id)
-
-            occupied_beds_number = beds_number - len(beds)
-            no_shows_number = 0
-
-            queue = (
-                session.query(PatientQueue)
-                .options(
-                    joinedload(PatientQueue.medical_procedure).joinedload(MedicalProcedure.department),
-                    joinedload(PatientQueue.personnel_queue_assignment).joinedload(PersonnelQueueAssignment.personnel_member),
-                )
-                .filter(PatientQueue.admission_day == iteration + 2)
-                .order_by(PatientQueue.queue_id)
-                .all()
-            )
-            bed_iterator = 0
-
-            days_of_stay_for_replacement = []
-            personnels_for_replacement = []
-            departments_for_replacement = []
-
-            for i in range(min(len(queue), len(beds))):
-                entry = queue[i]
-                patient_id = entry.patient_id
-                will_come = rnd.choice([True] * NO_SHOW_PROBABILITY_TRUE_COUNT + [False])
-                if not will_come:
-                    no_shows_number += 1
-
-                    personnel_data = {}
-
-                    for personnel in entry.personnel_queue_assignment:
-                        personnel_data[personnel.personnel_member.first_name + " " + personnel.personnel_member.last_name] = (
-                            personnel.personnel_member.role
-                        )
-
-                    days_of_stay_for_replacement.append(entry.days_of_stay)
-                    personnels_for_replacement.append(personnel_data)
-                    departments_for_replacement.append(entry.medical_procedure.department.name)
-
-                    delete_patient_by_queue_id_from_queue(entry.queue_id)
-                    no_show = NoShow(patient_id=patient_id, patient_name=get_patient_name_by_id(patient_id))
-                    if should_give_no_shows:
-                        no_shows_list.append(no_show)
-                    if should_log:
-                        logger.info(f"No-show: {no_show.patient_name}")
-                elif check_if_patient_has_bed(patient_id):
-                    if should_log:
-                        logger.info(f"Patient {patient_id} already has a bed")
-                else:
-                    if iteration + 2 not in stay_lengths:
-                        stay_lengths[iteration + 2] = []
-                    stay_lengths[iteration + 2].append(entry.days_of_stay)
-
-                    assign_bed_to_patient(
-                        bed_map[entry.medical_procedure.department_id][0],
-                        patient_id,
-                        entry.procedure_id,
-                        entry.days_of_stay,
-                        entry.personnel_queue_assignment,
-                        should_log,
-                    )
-                    delete_patient_by_queue_id_from_queue(entry.queue_id)
-                    bed_map[entry.medical_procedure.department_id].pop(0)
-                    occupied_beds_number += 1
-                    bed_iterator += 1
-
-            for queue_id in consent_dict[iteration + 2]:
-                queue_entry = (
-                    session.query(PatientQueue)
-                    .filter_by(queue_id=queue_id)
-                    .options(joinedload(PatientQueue.medical_procedure), joinedload(PatientQueue.personnel_queue_assignment))
-                    .first()
-                )
-                if check_if_patient_has_bed(queue_entry.patient_id):
-                    if should_log:
-                        logger.info(f"Patient {queue_entry.patient_id} already has a bed")
-                else:
-                    if iteration + 2 not in stay_lengths:
-                        stay_lengths[iteration + 2] = []
-                    stay_lengths[iteration + 2].append(queue_entry.days_of_stay)
-
-                    assign_bed_to_patient(
-                        bed_map[queue_entry.medical_procedure.department_id][0],
-                        queue_entry.patient_id,
-                        queue_entry.procedure_id,
-                        queue_entry.days_of_stay,
-                        queue_entry.personnel_queue_assignment,
-                        should_log,
-                    )
-                    delete_patient_by_queue_id_from_queue(queue_id)
-                    bed_map[queue_entry.medical_procedure.department_id].pop(0)
-                    occupied_beds_number += 1
-                    bed_iterator += 1
-
-            days_of_stay_for_replacement = days_of_stay_for_replacement[len(consent_dict[iteration + 2]) :]
-            personnels_for_replacement = personnels_for_replacement[len(consent_dict[iteration + 2]) :]
-            departments_for_replacement = departments_for_replacement[len(consent_dict[iteration + 2]) :]
-
-            occupancy_in_time["Date"].append(iteration + 2)
-            occupancy_in_time["Occupancy"].append(occupied_beds_number / beds_number * 100)
-
-            no_shows_in_time["Date"].append(iteration + 2)
-            if len(beds) > 0:
-                no_shows_in_time["NoShows"].append(no_shows_number / len(beds) * 100)
-            else:
-                no_shows_in_time["NoShows"].append("No incoming patients")
-
-            no_shows_in_time["NoShowsNumber"].append(no_shows_number)
-
-        all_bed_assignments = []
-        department_assignments = {}
-        for bed in (
-            session.query(Bed)
-            .options(
-                joinedload(Bed.assignments).joinedload(BedAssignment.patient),
-                joinedload(Bed.assignments).joinedload(BedAssignment.medical_procedure),
-                joinedload(Bed.assignments)
-                .joinedload(BedAssignment.stay_personnel_assignment)
-                .joinedload(StayPersonnelAssignment.personnel_member),
-                joinedload(Bed.department),
-            )
-            .order_by(Bed.bed_id)
-            .all()
-        ):
-            ba = bed.assignments[0] if bed.assignments else None
-            patient = ba.patient if ba else None
-
-            patient_name = f"{patient.first_name} {patient.last_name}" if patient else "Unoccupied"
-            medical_procedure = ba.medical_procedure.name if ba else "Unoccupied"
-            pesel = patient.pesel if patient else "Unoccupied"
-            nationality = patient.nationality if patient else "Unoccupied"
-            personnel_assignments = ba.stay_personnel_assignment if ba else None
-            personnel_data = {}
-
-            if personnel_assignments:
-                for assignment in personnel_assignments:
-                    personnel_data[assignment.personnel_member.first_name + " " + assignment.personnel_member.last_name] = (
-                        assignment.personnel_member.role
-                    )
-
-            days_of_stay = ba.days_of_stay if ba else 0
-
-            assignment = {
-                "bed_id": bed.bed_id,
-                "patient_id": ba.patient_id if ba else 0,
-                "patient_name": patient_name,
-                "medical_procedure": medical_procedure,
-                "pesel": pesel,
-                "nationality": nationality,
-                "days_of_stay": days_of_stay,
-                "personnel": personnel_data,
-            }
-
-            all_bed_assignments.append(assignment)
-
-            if bed.department.name not in department_assignments:
-                department_assignments[bed.department.name] = []
-
-            department_assignments[bed.department.name].append(assignment)
-
-        queue_data = []
-        for entry in (
-            session.query(PatientQueue)
-            .options(
-                joinedload(PatientQueue.patient),
-                joinedload(PatientQueue.medical_procedure).joinedload(MedicalProcedure.department),
-                joinedload(PatientQueue.personnel_queue_assignment).joinedload(PersonnelQueueAssignment.personnel_member),
-            )
-            .order_by(PatientQueue.queue_id)
-            .all()
-        ):
-            personnel_data = {}
-
-            for personnel in entry.personnel_queue_assignment:
-                personnel_data[personnel.personnel_member.first_name + " " + personnel.personnel_member.last_name] = (
-                    personnel.personnel_member.role
-                )
-
-            queue_data.append(
-                {
-                    "place_in_queue": entry.queue_id,
-                    "patient_id": entry.patient_id,
-                    "patient_name": f"{entry.patient.first_name} {entry.patient.last_name}",
-                    "pesel": f"...{entry.patient.pesel[-3:]}",
-                    "nationality": entry.patient.nationality,
-                    "days_of_stay": entry.days_of_stay,
-                    "admission_day": entry.admission_day,
-                    "medical_procedure": entry.medical_procedure.name,
-                    "department": entry.medical_procedure.department.name,
-                    "personnel": personnel_data,
-                }
-            )
 
-        session.rollback()
-        session.close()
-
-        return ListOfTables(
-            DepartmentAssignments=department_assignments,
-            AllBedAssignments=all_bed_assignments,
-            PatientQueue=queue_data,
-            NoShows=[n.model_dump() for n in no_shows_list],
-            Statistics=calculate_statistics(),
-            ReplacementData={
-                "DaysOfStay": days_of_stay_for_replacement,
-                "Personnels": personnels_for_replacement,
-                "Departments": departments_for_replacement,
-            },
-        )
+@app.get("/get-replacement-data")
+async def get_replacement_data(
+    session_id: str = Query(DEFAULT_SESSION_ID),
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+) -> Dict[str, DataForReplacement]:
+    """
+    Returns data of freed places that can be offered to patients of the current day of the simulation.
+    :param session_id: Id of the simulation session.
+    :param if_none_match: ETag of the response the client already has.
+    :param accept_encoding: Content codings accepted by the client.
+    :return: A JSON object with ReplacementData.
+    """
+    return await get_tables_response(session_id, ("ReplacementData",), if_none_match, accept_encoding=accept_encoding)
 
-    except Exception as e:
-        error_message = f"Error occurred: {str(e)}\n{traceback.format_exc()}"
-        logger.error(error_message)
-        return {"error": "Server Error", "message": error_message}
 
+@app.get("/add-patient-to-approvers", response_model=Dict[str, int])
+async def add_patient_to_approvers(queue_id: int, session_id: str = Query(DEFAULT_SESSION_ID)) -> Dict[str, int]:
+    def add_consent(state: SimulationState) -> bool:
+        state.consents[state.day].append(queue_id)
+        return True
 
-@app.get("/add-patient-to-approvers")
-def add_patient_to_approvers(queue_id: int) -> None:
-    patients_consent_dictionary[day_for_simulation].append(queue_id)
+    state = await update_state(session_id, add_consent, CONSENT_ADDED)
+    return {"version": state.version}
 
 
-@app.get("/increase-calls-number")
-def increase_calls_number() -> None:
-    calls_in_time["CallsNumber"][day_for_simulation - 1] += 1
+@app.get("/increase-calls-number", response_model=Dict[str, int])
+async def increase_calls_number(session_id: str = Query(DEFAULT_SESSION_ID)) -> Dict[str, int]:
+    def add_call(state: SimulationState) -> bool:
+        state.calls["CallsNumber"][state.day - 1] += 1
+        return True
 
+    state = await update_state(session_id, add_call, CALL_COUNTED)
+    return {"version": state.version}
 
-@app.get("/get-patient-data")
-def get_patient_data(patient_id: int):
-    session = get_session()
+
+def get_patient_gender(session: Session, patient_id: int) -> Dict[str, str]:
     patient = session.query(Patient).filter_by(patient_id=patient_id).first()
-    gender = patient.gender
-    session.rollback()
-    session.close()
-    return {"gender": gender}
+    return {"gender": patient.gender}
+
+
+@app.get("/get-patient-data")
+async def get_patient_data(patient_id: int):
+    return await run_with_session(lambda session: get_patient_gender(session, patient_id))
+
+
+@app.get("/get-patient-queue-entries")
+async def get_patient_queue_entries(
+    patient_id: List[int] = Query(...), session_id: str = Query(DEFAULT_SESSION_ID)
+) -> List[Dict[str, int]]:
+    """
+    Returns queue entries of patients that are planned for the current day or later and are still waiting.
+    :param patient_id: Ids of the patients, the parameter can be repeated to get entries of many patients at once.
+    :param session_id: Id of the simulation session.
+    :return: List with patient id, place in queue, admission day and days of stay of every entry.
+    """
+    _, day, log, consent_dict, _, _ = await snapshot_state(session_id)
+    session = sessions.get(session_id)
+    engine_factory = await get_engine_factory()
+
+    def get_entries(engine: SimulationEngine) -> List[Dict[str, int]]:
+        engine.sync(day, consent_dict, log=log)
+        return engine.get_future_queue_entries(patient_id, day)
+
+    return await run_in_threadpool(run_with_engine, session, engine_factory, get_entries)
+
+
+@app.get("/get-simulation-statistics")
+async def get_simulation_statistics(
+    session_id: str = Query(DEFAULT_SESSION_ID),
+) -> Dict[str, Union[int, Dict[int, int]]]:
+    """
+    Returns the number and memory footprint of day checkpoints kept by the simulation engine of a session.
+    :param session_id: Id of the simulation session.
+    :return: JSON object with the engine's current day and sizes of its checkpoints.
+    """
+    session = sessions.get(session_id)
+    engine_factory = await get_engine_factory()
+    return await run_in_threadpool(
+        run_with_engine, session, engine_factory, lambda engine: engine.get_checkpoints_statistics()
+    )
+
+
+@app.get("/get-session-statistics")
+async def get_session_statistics() -> Dict[str, int]:
+    """
+    Returns the number of simulation sessions kept by this worker and the memory their engines take.
+    :return: JSON object with numbers of sessions and evicted sessions, their size in bytes and the limits.
+    """
+    return sessions.get_statistics()
+
+
+@app.get("/get-cache-statistics")
+async def get_cache_statistics(session_id: str = Query(DEFAULT_SESSION_ID)) -> Dict[str, Union[int, float, str]]:
+    """
+    Returns usage statistics of the response cache and of request coalescing of this worker.
+    :param session_id: Id of the simulation session whose state version and token are reported.
+    :return: JSON object with the current state version and token, cache size, hits, misses and coalesced requests.
+    """
+    state = await load_state(session_id)
+    return {
+        "state_version": state.version,
+        "state_token": state.token,
+        **response_cache.get_statistics(),
+        **tables_flight.get_statistics(),
+    }
+
+
+@app.get("/get-pool-statistics")
+async def get_database_pool_statistics() -> Dict[str, Union[int, str]]:
+    """
+    Returns usage statistics of the database connection pool of this worker.
+    :return: JSON object with pool size, checked in and checked out connections and overflow.
+    """
+    return get_pool_statistics()
@@ -1,9 +1,15 @@
-from typing import Optional
+import json
+from typing import Any, Dict, Iterator, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
 from sqlalchemy import Column, ForeignKey, Integer, String
 from sqlalchemy.orm import declarative_base, relationship
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 Base = declarative_base()
 
 
@@ -71,6 +77,150 @@ class ListOfTables(BaseModel):
     ReplacementData: DataForReplacement
 
 
+class NormalizedBedAssignment(BaseModel):
+    bed_id: int
+    department: int
+    patient_id: int
+    patient_name: str
+    medical_procedure: int
+    pesel: str
+    nationality: str
+    days_of_stay: int
+    personnel: list[int]
+
+
+class NormalizedQueueEntry(BaseModel):
+    place_in_queue: int
+    patient_id: int
+    patient_name: str
+    pesel: str
+    nationality: str
+    admission_day: int
+    days_of_stay: int
+    medical_procedure: int
+    department: int
+    personnel: list[int]
+
+
+class NormalizedTables(BaseModel):
+    """
+    ListOfTables with every bed sent once. Departments, procedures and personnel members (name and role) are sent once
+    in lookup tables and referenced by their index in them.
+    """
+
+    Departments: list[str]
+    Procedures: list[str]
+    Personnel: list[tuple[str, str]]
+    Beds: list[NormalizedBedAssignment]
+    PatientQueue: list[NormalizedQueueEntry]
+    NoShows: list[NoShow]
+    Statistics: Statistics
+    ReplacementData: DataForReplacement
+
+
+class QueueChanges(BaseModel):
+    Removed: list[int]
+    Added: list[PatientQueueResponse]
+
+
+class TableChanges(BaseModel):
+    """
+    Changes of ListOfTables between two state versions. Beds are the changed rows of AllBedAssignments. Queue entries
+    are removed by their old place in queue and added with their new one, the remaining entries keep their order and
+    take the places not taken by added entries. A series of Statistics is sent as the number of its points to keep
+    and the points following them, other fields of Statistics are sent if they changed. NoShows and ReplacementData
+    are None if they did not change.
+    """
+
+    Since: int
+    Version: int
+    Day: int
+    Beds: list[BedAssignmentResponse]
+    PatientQueue: QueueChanges
+    NoShows: Optional[list[NoShow]]
+    Statistics: dict[str, Any]
+    ReplacementData: Optional[DataForReplacement]
+
+
+TABLE_FIELDS = tuple(ListOfTables.model_fields)
+TABLE_FIELD_ADAPTERS = {name: TypeAdapter(field.annotation) for name, field in ListOfTables.model_fields.items()}
+NORMALIZED_TABLE_FIELDS = tuple(NormalizedTables.model_fields)
+NORMALIZED_TABLE_FIELD_ADAPTERS = {
+    name: TypeAdapter(field.annotation) for name, field in NormalizedTables.model_fields.items()
+}
+NORMALIZED_LOOKUP_FIELDS = ("Departments", "Procedures", "Personnel")
+
+
+def dump_json(value: Any) -> bytes:
+    """
+    Serializes plain Python values with orjson, or with the standard library if orjson is not installed.
+    :param value: Dictionaries, lists, tuples, strings, numbers, booleans and None.
+    :return: Compact UTF-8 JSON, the same as pydantic produces for these values.
+    """
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def iter_json_parts(value: Any) -> Iterator[bytes]:
+    """
+    :param value: Value to serialize, lists may be given as iterators, also nested in dictionaries.
+    :return: Parts of the JSON, items of iterators are consumed and serialized one at a time.
+    """
+    if isinstance(value, dict):
+        yield b"{"
+        for index, (key, item) in enumerate(value.items()):
+            yield (b"," if index else b"") + dump_json(key) + b":"
+            yield from iter_json_parts(item)
+        yield b"}"
+    elif isinstance(value, Iterator):
+        yield b"["
+        for index, item in enumerate(value):
+            yield b"," + dump_json(item) if index else dump_json(item)
+        yield b"]"
+    else:
+        yield dump_json(value)
+
+
+def iter_dump_json(value: Any, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """
+    Serializes like dump_json, but lists given as iterators are serialized as they are produced.
+    :param value: Value to serialize, e.g. the result of SimulationEngine.iter_table_fields.
+    :param chunk_size: Approximate size of the yielded chunks in bytes.
+    :return: Chunks of the JSON.
+    """
+    buffer = bytearray()
+    for part in iter_json_parts(value):
+        buffer += part
+        if len(buffer) >= chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+def dump_tables_json(
+    values: Dict[str, Any], adapters: Dict[str, TypeAdapter] = TABLE_FIELD_ADAPTERS, validate: bool = False
+) -> bytes:
+    """
+    Serializes a subset of ListOfTables fields, the full set gives the same JSON as ListOfTables.
+    Values built by the simulation engine already have the types of the models, so by default they are serialized
+    directly. With validate they go through pydantic first, which catches an engine building a wrong response.
+    :param values: Values of the selected fields, in the order of TABLE_FIELDS.
+    :param adapters: Adapters of the fields, NORMALIZED_TABLE_FIELD_ADAPTERS for fields of NormalizedTables.
+    :param validate: Whether to validate the values against the models.
+    :return: JSON object with the selected fields.
+    """
+    if not validate:
+        return dump_json(values)
+
+    parts = []
+    for name, value in values.items():
+        adapter = adapters[name]
+        parts.append(b'"' + name.encode() + b'":' + adapter.dump_json(adapter.validate_python(value)))
+    return b"{" + b",".join(parts) + b"}"
+
+
 class Patient(Base):
     __tablename__ = "patients"
     patient_id = Column(Integer, primary_key=True)
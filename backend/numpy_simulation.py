@@ -0,0 +1,136 @@
+import sys
+from typing import List, Optional
+
+from simulation import HospitalData, QueueEntryRecord, SimulationEngine, StayRecord
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+FREE_BED = -1
+
+
+class NumpySimulationEngine(SimulationEngine):
+    """
+    Simulation engine keeping bed state in fixed-size NumPy arrays indexed by the bed's position in bed id order.
+    Stays are shortened, finished stays released and free beds looked up with vectorized operations,
+    while queue handling, no-shows and statistics are shared with SimulationEngine, so both give identical results.
+    """
+
+    def __init__(self, data: HospitalData):
+        if np is None:
+            raise ImportError("NumpySimulationEngine requires numpy, install it or use the python simulation engine")
+        self.bed_ids = np.fromiter(data.bed_departments.keys(), dtype=np.int64, count=len(data.bed_departments))
+        self.bed_slots = {bed_id: slot for slot, bed_id in enumerate(data.bed_departments)}
+        bed_department_ids = np.fromiter(data.bed_departments.values(), dtype=np.int64, count=len(data.bed_departments))
+        self.department_slots = {
+            department_id: np.flatnonzero(bed_department_ids == department_id)
+            for department_id in np.unique(bed_department_ids).tolist()
+        }
+        super().__init__(data)
+
+    def init_beds(self) -> None:
+        """
+        Sets up bed arrays from the bed assignments read from the database, free beds hold FREE_BED as patient id.
+        """
+        beds_number = len(self.bed_ids)
+        self.bed_patients = np.full(beds_number, FREE_BED, dtype=np.int64)
+        self.bed_procedures = np.zeros(beds_number, dtype=np.int64)
+        self.bed_days = np.zeros(beds_number, dtype=np.int64)
+        self.bed_personnel: List[Optional[List[int]]] = [None] * beds_number
+        for bed_id, stay in self.data.stays.items():
+            slot = self.bed_slots[bed_id]
+            self.bed_patients[slot] = stay.patient_id
+            self.bed_procedures[slot] = stay.procedure_id
+            self.bed_days[slot] = stay.days_of_stay
+            self.bed_personnel[slot] = stay.personnel_ids
+        self.count_beds_per_patient()
+
+    def snapshot_beds(self) -> tuple:
+        """
+        :return: Copies of the bed arrays, they can be passed to restore_beds later.
+        """
+        return self.bed_patients.copy(), self.bed_procedures.copy(), self.bed_days.copy(), tuple(self.bed_personnel)
+
+    def restore_beds(self, snapshot: tuple) -> None:
+        """
+        Brings back bed arrays saved with snapshot_beds.
+        :param snapshot: Result of an earlier snapshot_beds call.
+        """
+        patients, procedures, days, personnel = snapshot
+        self.bed_patients = patients.copy()
+        self.bed_procedures = procedures.copy()
+        self.bed_days = days.copy()
+        self.bed_personnel = list(personnel)
+        self.count_beds_per_patient()
+
+    def beds_size_in_bytes(self, snapshot: tuple) -> int:
+        """
+        :param snapshot: Result of an earlier snapshot_beds call.
+        :return: Approximate memory taken by the snapshot in bytes.
+        """
+        patients, procedures, days, personnel = snapshot
+        return patients.nbytes + procedures.nbytes + days.nbytes + sys.getsizeof(personnel)
+
+    def free_beds_number(self) -> int:
+        return int(np.count_nonzero(self.bed_patients == FREE_BED))
+
+    def occupied_beds_number(self) -> int:
+        return len(self.bed_ids) - self.free_beds_number()
+
+    def get_stay(self, bed_id: int) -> Optional[StayRecord]:
+        slot = self.bed_slots[bed_id]
+        if self.bed_patients[slot] == FREE_BED:
+            return None
+        return StayRecord(
+            int(self.bed_patients[slot]), int(self.bed_procedures[slot]), int(self.bed_days[slot]), self.bed_personnel[slot]
+        )
+
+    def count_beds_per_patient(self) -> None:
+        """
+        Rebuilds the number of occupied beds per patient from the bed arrays.
+        """
+        patient_ids, counts = np.unique(self.bed_patients[self.bed_patients != FREE_BED], return_counts=True)
+        self.beds_per_patient = dict(zip(patient_ids.tolist(), counts.tolist()))
+
+    def occupy_bed(self, entry: QueueEntryRecord) -> int:
+        """
+        Puts the patient of the queue entry into the free bed with the lowest id in the entry's department.
+        :param entry: Admitted queue entry.
+        :return: Id of the occupied bed.
+        :raises IndexError: If the department has no free bed.
+        """
+        slots = self.department_slots[entry.department_id]
+        slot = int(slots[np.flatnonzero(self.bed_patients[slots] == FREE_BED)[0]])
+        self.bed_patients[slot] = entry.patient_id
+        self.bed_procedures[slot] = entry.procedure_id
+        self.bed_days[slot] = entry.days_of_stay
+        self.bed_personnel[slot] = entry.personnel_ids
+        self.beds_per_patient[entry.patient_id] = self.beds_per_patient.get(entry.patient_id, 0) + 1
+        return int(self.bed_ids[slot])
+
+    def release_finished_stays(self, log: bool) -> None:
+        """
+        Shortens every stay by one day and frees beds of patients whose stay is over, all in vectorized steps.
+        :param log: Whether to log the released patients.
+        """
+        occupied = self.bed_patients != FREE_BED
+        self.bed_days[occupied] -= 1
+        released = np.flatnonzero(occupied & (self.bed_days <= 0))
+        if not len(released):
+            return
+
+        released_patients = self.bed_patients[released].tolist()
+        if log:
+            self.log_released_patients(released_patients)
+        for patient_id in released_patients:
+            if self.beds_per_patient[patient_id] == 1:
+                del self.beds_per_patient[patient_id]
+            else:
+                self.beds_per_patient[patient_id] -= 1
+        self.bed_patients[released] = FREE_BED
+        self.bed_procedures[released] = 0
+        self.bed_days[released] = 0
+        for slot in released.tolist():
+            self.bed_personnel[slot] = None
@@ -0,0 +1,113 @@
+import hashlib
+import json
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List, Optional, Union
+
+
+def get_state_token(
+    day: int, last_change: int, consent_dict: Dict[int, List[int]], calls_numbers_dict: Dict[str, list]
+) -> str:
+    """
+    Derives a token identifying the simulation state, equal states always give equal tokens.
+    :param day: Current simulation day.
+    :param last_change: Direction of the last day change, -1 or 1.
+    :param consent_dict: Place in queue of patients who agreed to come earlier, per simulation day.
+    :param calls_numbers_dict: Number of phone calls made per simulation day.
+    :return: Hex digest of the state.
+    """
+    state = json.dumps([day, last_change, consent_dict, calls_numbers_dict], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(state.encode()).hexdigest()[:32]
+
+
+class ResponseCache:
+    """
+    Thread-safe LRU cache of serialized responses keyed by state token.
+    """
+
+    def __init__(self, max_size: int):
+        """
+        :param max_size: Maximum number of stored responses, 0 disables caching.
+        """
+        self.max_size = max_size
+        self.responses: OrderedDict[str, bytes] = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[bytes]:
+        """
+        :param token: State token of the response.
+        :return: Serialized response or None if it is not cached.
+        """
+        with self.lock:
+            response = self.responses.get(token)
+            if response is None:
+                self.misses += 1
+                return None
+            self.responses.move_to_end(token)
+            self.hits += 1
+            return response
+
+    def peek(self, token: str) -> Optional[bytes]:
+        """
+        Looks up a response without counting a hit or miss and without changing its recency.
+        :param token: State token of the response.
+        :return: Serialized response or None if it is not cached.
+        """
+        with self.lock:
+            return self.responses.get(token)
+
+    def put(self, token: str, response: bytes) -> None:
+        """
+        Stores a response, evicting the least recently used one if the cache is full.
+        :param token: State token of the response.
+        :param response: Serialized response.
+        """
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.responses[token] = response
+            self.responses.move_to_end(token)
+            while len(self.responses) > self.max_size:
+                self.responses.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.responses.clear()
+
+    def get_statistics(self) -> Dict[str, Union[int, float]]:
+        """
+        :return: Dictionary with size, capacity, hits, misses and hit ratio of the cache.
+        """
+        with self.lock:
+            requests_number = self.hits + self.misses
+            return {
+                "size": len(self.responses),
+                "max_size": self.max_size,
+                "size_in_bytes": sum(len(response) for response in self.responses.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / requests_number if requests_number else 0.0,
+            }
+
+
+def get_etag(token: str) -> str:
+    """
+    :param token: State token of the response.
+    :return: Strong ETag header value, the response is fully determined by the state.
+    """
+    return f'"{token}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Checks an If-None-Match header against the current ETag.
+    :param if_none_match: Value of the If-None-Match header, may list several ETags or be "*".
+    :param etag: Current ETag of the resource.
+    :return: True if the client already has the current response.
+    """
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
@@ -0,0 +1,102 @@
+from dataclasses import dataclass
+from typing import Optional, Union
+
+Number = Union[int, float]
+
+
+@dataclass(frozen=True)
+class DailyStatistic:
+    """
+    Running statistic of a series with one value per day, None for days without a value. Only the count and sum
+    of the values before the last one are kept, with the last and previous values, so every metric is O(1).
+    Sums are accumulated in the order of the series, so they are equal to summing the whole list.
+    Immutable, so it can be stored in checkpoints.
+    """
+
+    days: int = 0
+    count: int = 0
+    total: Number = 0
+    last: Optional[Number] = None
+    previous: Optional[Number] = None
+
+    def add(self, value: Optional[Number]) -> "DailyStatistic":
+        """
+        :param value: Value of the next day, None if the day has no value.
+        :return: Statistic with the value appended.
+        """
+        if self.last is None:
+            return DailyStatistic(self.days + 1, self.count, self.total, value, self.last)
+        return DailyStatistic(self.days + 1, self.count + 1, self.total + self.last, value, self.last)
+
+    def replace_last(self, value: Optional[Number]) -> "DailyStatistic":
+        """
+        :param value: New value of the last day.
+        :return: Statistic with the last value replaced.
+        """
+        return DailyStatistic(self.days, self.count, self.total, value, self.previous)
+
+    @property
+    def difference(self) -> Optional[Number]:
+        """
+        :return: Last value minus the previous one, None if either is missing.
+        """
+        if self.last is None or self.previous is None:
+            return None
+        return self.last - self.previous
+
+    @property
+    def average(self) -> Optional[float]:
+        """
+        :return: Average of all values, None if there are none.
+        """
+        if self.last is None:
+            return self.previous_average
+        return (self.total + self.last) / (self.count + 1)
+
+    @property
+    def previous_average(self) -> Optional[float]:
+        """
+        :return: Average of the values before the last day, None if there are none.
+        """
+        return self.total / self.count if self.count else None
+
+
+@dataclass(frozen=True)
+class GroupedStatistic:
+    """
+    Running statistic of values grouped by day, e.g. lengths of stays by admission day. Only the count and sum of
+    the groups before the last one are kept, with the count and sum of the last group, so every metric is O(1).
+    Immutable, so it can be stored in checkpoints.
+    """
+
+    groups: int = 0
+    count: int = 0
+    total: Number = 0
+    last_day: Optional[int] = None
+    last_count: int = 0
+    last_total: Number = 0
+
+    def add(self, day: int, value: Number) -> "GroupedStatistic":
+        """
+        :param day: Day of the value, not earlier than the day of the last group.
+        :param value: Value to add.
+        :return: Statistic with the value added to the group of the day.
+        """
+        if day == self.last_day:
+            return GroupedStatistic(self.groups, self.count, self.total, day, self.last_count + 1, self.last_total + value)
+        return GroupedStatistic(self.groups + 1, self.count + self.last_count, self.total + self.last_total, day, 1, value)
+
+    @property
+    def average(self) -> Optional[float]:
+        """
+        :return: Average of all values, None if there are none.
+        """
+        count = self.count + self.last_count
+        return (self.total + self.last_total) / count if count else None
+
+    @property
+    def previous_average(self) -> Optional[float]:
+        """
+        :return: Average of the values of all groups but the last one, None if there are none.
+        """
+        return self.total / self.count if self.count else None
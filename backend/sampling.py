@@ -0,0 +1,70 @@
+from typing import Iterable, List
+
+MASK_64 = (1 << 64) - 1
+
+
+def splitmix64(value: int) -> int:
+    """
+    Scrambles a 64-bit integer with the SplitMix64 finalizer.
+    :param value: Any integer, only its lowest 64 bits are used.
+    :return: Well mixed 64-bit integer.
+    """
+    value = (value + 0x9E3779B97F4A7C15) & MASK_64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK_64
+    return value ^ (value >> 31)
+
+
+class CounterBasedRandom:
+    """
+    Random stream addressed by counters instead of consumed sequentially.
+    The same (seed, day, key) always gives the same number, so any draw can be made independently of all others.
+    """
+
+    def __init__(self, seed: int):
+        self.seed = seed
+        self.seed_hash = splitmix64(seed)
+
+    def random_bits(self, day: int, key: int) -> int:
+        """
+        :param day: Simulation day of the draw.
+        :param key: Identifier of the drawn object, e.g. id of a queue entry.
+        :return: Uniformly distributed 64-bit integer.
+        """
+        return splitmix64(splitmix64(self.seed_hash ^ (day & MASK_64)) ^ (key & MASK_64))
+
+    def random(self, day: int, key: int) -> float:
+        """
+        :param day: Simulation day of the draw.
+        :param key: Identifier of the drawn object, e.g. id of a queue entry.
+        :return: Uniformly distributed float in [0, 1).
+        """
+        return (self.random_bits(day, key) >> 11) * 2.0**-53
+
+
+class NoShowSampler:
+    """
+    Decides whether a queue entry comes on its admission day, with the same odds as choosing from
+    true_count times True and one False.
+    """
+
+    def __init__(self, seed: int, true_count: int):
+        self.stream = CounterBasedRandom(seed)
+        self.outcomes_number = true_count + 1
+
+    def is_no_show(self, day: int, entry_id: int) -> bool:
+        """
+        :param day: Simulation day the patient is expected on.
+        :param entry_id: Id of the patient's queue entry.
+        :return: True if the patient does not come.
+        """
+        return self.stream.random_bits(day, entry_id) % self.outcomes_number == 0
+
+    def draw_no_shows(self, day: int, entry_ids: Iterable[int]) -> List[bool]:
+        """
+        Draws no-shows for many queue entries at once, the result does not depend on order or on other entries.
+        :param day: Simulation day the patients are expected on.
+        :param entry_ids: Ids of the patients' queue entries.
+        :return: List with True for every patient who does not come.
+        """
+        return [self.is_no_show(day, entry_id) for entry_id in entry_ids]
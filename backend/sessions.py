@@ -0,0 +1,129 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Dict, List, Optional
+
+from simulation import SimulationEngine
+
+
+class SimulationSession:
+    """
+    Simulation engine of one session, created on first use. The engine has to be used with the session lock held.
+    """
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.engine: Optional[SimulationEngine] = None
+        self.lock = Lock()
+        self.last_used = time.monotonic()
+        self.size_in_bytes = 0
+
+    def get_engine(self, engine_factory: Callable[[], SimulationEngine]) -> SimulationEngine:
+        """
+        Must be called with the session lock held.
+        :param engine_factory: Creates the engine if the session does not have one yet.
+        :return: Simulation engine of the session.
+        """
+        if self.engine is None:
+            self.engine = engine_factory()
+        return self.engine
+
+    def drop_engine(self) -> None:
+        """
+        Drops the engine with its checkpoints, the next use creates a new one. Must be called with the session lock held.
+        """
+        self.engine = None
+        self.size_in_bytes = 0
+
+    def update_size(self) -> None:
+        """
+        Recomputes the memory taken by the engine's checkpoints. Must be called with the session lock held.
+        """
+        if self.engine is not None:
+            self.size_in_bytes = self.engine.get_checkpoints_statistics()["checkpoints_size_in_bytes"]
+
+
+class SessionManager:
+    """
+    Bounded LRU of simulation sessions. Sessions idle for longer than the timeout are dropped, and the least recently
+    used ones are dropped while there are too many sessions or their engines take too much memory. Only the engine
+    and its checkpoints are dropped with a session, its state is kept by the state store.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int,
+        idle_timeout: float,
+        max_size_in_bytes: int,
+        on_evict: Optional[Callable[[str], None]] = None,
+    ):
+        """
+        :param max_sessions: Maximum number of sessions kept.
+        :param idle_timeout: Seconds after the last use when a session is dropped.
+        :param max_size_in_bytes: Maximum memory taken by checkpoints of all sessions.
+        :param on_evict: Called with the id of every dropped session.
+        """
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_size_in_bytes = max_size_in_bytes
+        self.on_evict = on_evict
+        self.sessions: OrderedDict[str, SimulationSession] = OrderedDict()
+        self.lock = Lock()
+        self.evicted = 0
+
+    def get(self, session_id: str) -> SimulationSession:
+        """
+        Marks the session as most recently used, creating it if needed, and drops sessions over the limits.
+        :param session_id: Id of the simulation session.
+        :return: The session.
+        """
+        with self.lock:
+            now = time.monotonic()
+            session = self.sessions.get(session_id)
+            if session is None:
+                session = SimulationSession(session_id)
+                self.sessions[session_id] = session
+            session.last_used = now
+            self.sessions.move_to_end(session_id)
+            evicted_ids = self.evict(now)
+
+        if self.on_evict is not None:
+            for evicted_id in evicted_ids:
+                self.on_evict(evicted_id)
+        return session
+
+    def evict(self, now: float) -> List[str]:
+        """
+        Drops idle sessions and least recently used sessions over the limits, never the most recently used one.
+        Must be called with the lock held.
+        :param now: Current time.
+        :return: Ids of the dropped sessions.
+        """
+        evicted_ids = []
+        size_in_bytes = sum(session.size_in_bytes for session in self.sessions.values())
+        while len(self.sessions) > 1:
+            session = next(iter(self.sessions.values()))
+            if (
+                now - session.last_used <= self.idle_timeout
+                and len(self.sessions) <= self.max_sessions
+                and size_in_bytes <= self.max_size_in_bytes
+            ):
+                break
+            self.sessions.popitem(last=False)
+            size_in_bytes -= session.size_in_bytes
+            evicted_ids.append(session.session_id)
+        self.evicted += len(evicted_ids)
+        return evicted_ids
+
+    def get_statistics(self) -> Dict[str, int]:
+        """
+        :return: Dictionary with number of sessions, their memory, limits and number of evicted sessions.
+        """
+        with self.lock:
+            return {
+                "sessions_number": len(self.sessions),
+                "max_sessions": self.max_sessions,
+                "size_in_bytes": sum(session.size_in_bytes for session in self.sessions.values()),
+                "max_size_in_bytes": self.max_size_in_bytes,
+                "evicted": self.evicted,
+            }
@@ -0,0 +1,930 @@
+import logging
+import sys
+from dataclasses import dataclass, field
+from typing import Any, Collection, Dict, Iterator, List, Optional, Tuple, Union
+
+from indexes import AdmissionDayIndex, DictionaryEncoder, FreeBedIndex, QueuePositionIndex
+from models import (
+    NORMALIZED_TABLE_FIELDS,
+    TABLE_FIELDS,
+    Bed,
+    BedAssignment,
+    Department,
+    ListOfTables,
+    MedicalProcedure,
+    NoShow,
+    Patient,
+    PatientQueue,
+    PersonnelMember,
+    PersonnelQueueAssignment,
+    Statistics,
+    StayPersonnelAssignment,
+)
+from running_statistics import DailyStatistic, GroupedStatistic
+from sampling import NoShowSampler
+from sqlalchemy.orm import Session
+
+NO_SHOW_PROBABILITY_TRUE_COUNT = 30
+NO_SHOW_SEED = 43
+
+logger = logging.getLogger("hospital_logger")
+
+
+@dataclass
+class PatientRecord:
+    name: str
+    pesel: str
+    nationality: str
+
+
+@dataclass
+class ProcedureRecord:
+    name: str
+    department_id: int
+
+
+@dataclass
+class PersonnelRecord:
+    name: str
+    role: str
+
+
+@dataclass
+class StayRecord:
+    patient_id: int
+    procedure_id: int
+    days_of_stay: int
+    personnel_ids: List[int] = field(default_factory=list)
+
+
+@dataclass
+class QueueEntryRecord:
+    """
+    Queue entry as read from the database, together with its procedure, department and personnel already resolved.
+    """
+
+    entry_id: int
+    queue_id: int
+    patient_id: int
+    procedure_id: int
+    days_of_stay: int
+    admission_day: int
+    personnel_ids: List[int]
+    medical_procedure: str
+    department_id: int
+    department: str
+    personnel: Dict[str, str]
+
+
+@dataclass
+class DayCheckpoint:
+    """
+    Compact copy of the simulation state right after a day was simulated, before consents of that day were applied.
+    Its size is bounded by the number of beds and queue entries, personnel lists are shared with HospitalData.
+    Bed state is stored in the format of the engine that made the checkpoint, see SimulationEngine.snapshot_beds.
+    """
+
+    day: int
+    previous_day_consents: Tuple[int, ...]
+    beds: tuple
+    queue: bytes
+    free_beds_at_day_start: int
+    occupancy: float
+    occupancy_statistic: DailyStatistic
+    no_shows_number: int
+    no_shows_statistic: DailyStatistic
+    stay_length_statistic: GroupedStatistic
+    no_shows: Tuple[NoShow, ...]
+    days_of_stay_for_replacement: Tuple[int, ...]
+    personnels_for_replacement: Tuple[Dict[str, str], ...]
+    departments_for_replacement: Tuple[str, ...]
+
+    def size_in_bytes(self) -> int:
+        """
+        Approximates memory taken by the checkpoint, without objects shared with HospitalData and without bed state.
+        :return: Size in bytes.
+        """
+        size = sys.getsizeof(self.queue)
+        size += sys.getsizeof(self.no_shows)
+        size += sum(sys.getsizeof(personnel) for personnel in self.personnels_for_replacement)
+        return size
+
+
+@dataclass
+class HospitalData:
+    """
+    Snapshot of everything the simulation reads from the database.
+    It is loaded once and never modified, the engine works on its own copies of stays and tracks queue removals in an index.
+    """
+
+    departments: Dict[int, str]
+    bed_departments: Dict[int, int]
+    patients: Dict[int, PatientRecord]
+    procedures: Dict[int, ProcedureRecord]
+    personnel: Dict[int, PersonnelRecord]
+    stays: Dict[int, StayRecord]
+    queue: List[QueueEntryRecord]
+    admission_day_index: AdmissionDayIndex
+
+
+def load_hospital_data(session: Session) -> HospitalData:
+    """
+    Reads beds, bed assignments, queue entries, procedures and personnel into plain Python structures.
+    :param session: Database session used only for the initial reads.
+    :return: HospitalData with beds ordered by id and the queue ordered by place in queue.
+    """
+    departments = {d.department_id: d.name for d in session.query(Department).all()}
+    bed_departments = {b.bed_id: b.department_id for b in session.query(Bed).order_by(Bed.bed_id).all()}
+    patients = {
+        p.patient_id: PatientRecord(name=f"{p.first_name} {p.last_name}", pesel=p.pesel, nationality=p.nationality)
+        for p in session.query(Patient).all()
+    }
+    procedures = {
+        p.procedure_id: ProcedureRecord(name=p.name, department_id=p.department_id)
+        for p in session.query(MedicalProcedure).all()
+    }
+    personnel = {
+        m.member_id: PersonnelRecord(name=f"{m.first_name} {m.last_name}", role=m.role)
+        for m in session.query(PersonnelMember).all()
+    }
+
+    stays = {
+        a.bed_id: StayRecord(patient_id=a.patient_id, procedure_id=a.procedure_id, days_of_stay=a.days_of_stay)
+        for a in session.query(BedAssignment).all()
+    }
+    for assignment in session.query(StayPersonnelAssignment).order_by(StayPersonnelAssignment.assignment_id).all():
+        if assignment.bed_id in stays:
+            stays[assignment.bed_id].personnel_ids.append(assignment.member_id)
+
+    queue_personnel: Dict[int, List[int]] = {}
+    for assignment in session.query(PersonnelQueueAssignment).order_by(PersonnelQueueAssignment.assignment_id).all():
+        queue_personnel.setdefault(assignment.queue_id, []).append(assignment.member_id)
+
+    queue = []
+    for e in session.query(PatientQueue).order_by(PatientQueue.queue_id).all():
+        procedure = procedures[e.procedure_id]
+        personnel_ids = queue_personnel.get(e.id, [])
+        queue.append(
+            QueueEntryRecord(
+                entry_id=e.id,
+                queue_id=e.queue_id,
+                patient_id=e.patient_id,
+                procedure_id=e.procedure_id,
+                days_of_stay=e.days_of_stay,
+                admission_day=e.admission_day,
+                personnel_ids=personnel_ids,
+                medical_procedure=procedure.name,
+                department_id=procedure.department_id,
+                department=departments[procedure.department_id],
+                personnel={personnel[member_id].name: personnel[member_id].role for member_id in personnel_ids},
+            )
+        )
+
+    logger.info(f"Loaded {len(bed_departments)} beds, {len(stays)} bed assignments and {len(queue)} queue entries")
+
+    return HospitalData(
+        departments=departments,
+        bed_departments=bed_departments,
+        patients=patients,
+        procedures=procedures,
+        personnel=personnel,
+        stays=stays,
+        queue=queue,
+        admission_day_index=AdmissionDayIndex([entry.admission_day for entry in queue], [entry.patient_id for entry in queue]),
+    )
+
+
+def format_statistic(value: Optional[Union[int, float]], missing: str, suffix: str = "%") -> str:
+    """
+    :param value: Value of the statistic, None if it is missing.
+    :param missing: Text shown instead of a missing value.
+    :param suffix: Unit appended to the value.
+    :return: Value with at most 3 decimal places, without trailing zeros.
+    """
+    if value is None:
+        return missing
+    return f"{value:.3f}".rstrip("0").rstrip(".") + suffix
+
+
+def get_difference(value: Optional[float], previous: Optional[float]) -> Optional[float]:
+    """
+    :param value: Current value.
+    :param previous: Previous value.
+    :return: Difference of the values, None if either is missing.
+    """
+    return value - previous if value is not None and previous is not None else None
+
+
+def get_consents_statistic(consent_dict: Dict[int, List[int]], calls_numbers_dict: Dict[str, list]) -> DailyStatistic:
+    """
+    :param consent_dict: Place in queue of patients who agreed to come earlier, per simulation day.
+    :param calls_numbers_dict: Number of phone calls made per simulation day.
+    :return: Statistic of the percentage of calls ending with a consent, None for days without calls.
+    """
+    statistic = DailyStatistic()
+    for day, calls_number in enumerate(calls_numbers_dict["CallsNumber"], start=1):
+        statistic = statistic.add(len(consent_dict[day]) / calls_number * 100 if calls_number else None)
+    return statistic
+
+
+def calculate_statistics(
+    stay_length_statistic: GroupedStatistic,
+    occupancy_in_time: Dict[str, list],
+    occupancy_statistic: DailyStatistic,
+    no_shows_in_time: Dict[str, list],
+    no_shows_statistic: DailyStatistic,
+    consents_statistic: DailyStatistic,
+    calls_numbers_dict: Dict[str, list],
+) -> Statistics:
+    """
+    Builds statistics from running statistics of the simulated days, every metric is computed in O(1).
+    Differences are against the previous day, or for averages against the average without the last day.
+    :param stay_length_statistic: Lengths of stays by admission day.
+    :param occupancy_in_time: Dates and occupancy percentages of the simulated days.
+    :param occupancy_statistic: Statistic of the occupancy percentages.
+    :param no_shows_in_time: Dates and numbers of no-shows of the simulated days.
+    :param no_shows_statistic: Statistic of no-shows percentages, None for days without incoming patients.
+    :param consents_statistic: Statistic of consents percentages, None for days without calls.
+    :param calls_numbers_dict: Dates and numbers of phone calls.
+    :return: Statistics of the current day.
+    """
+    no_previous_day = "No previous day"
+    no_incoming_patients = "No incoming patients"
+    no_calls_made = "No calls made"
+
+    average_stay_length = stay_length_statistic.average
+    average_stay_length_difference = (
+        get_difference(average_stay_length, stay_length_statistic.previous_average)
+        if stay_length_statistic.groups != 1
+        else None
+    )
+
+    no_shows_missing = no_previous_day if no_shows_statistic.days == 1 else no_incoming_patients
+    consents_missing = (
+        no_previous_day if consents_statistic.days == 1 and consents_statistic.last is not None else no_calls_made
+    )
+
+    return Statistics(
+        OccupancyInTime=occupancy_in_time,
+        Occupancy=format_statistic(occupancy_statistic.last, no_previous_day),
+        OccupancyDifference=format_statistic(occupancy_statistic.difference, no_previous_day),
+        AverageOccupancy=format_statistic(occupancy_statistic.average, no_previous_day),
+        AverageOccupancyDifference=format_statistic(
+            get_difference(occupancy_statistic.average, occupancy_statistic.previous_average), no_previous_day
+        ),
+        AverageStayLength=format_statistic(average_stay_length, no_previous_day, suffix=""),
+        AverageStayLengthDifference=format_statistic(average_stay_length_difference, no_previous_day, suffix=""),
+        NoShowsInTime={"Date": no_shows_in_time["Date"], "NoShowsNumber": no_shows_in_time["NoShowsNumber"]},
+        NoShowsPercentage=format_statistic(no_shows_statistic.last, no_incoming_patients),
+        NoShowsPercentageDifference=format_statistic(no_shows_statistic.difference, no_shows_missing),
+        AverageNoShowsPercentage=format_statistic(no_shows_statistic.average, no_incoming_patients),
+        AverageNoShowsPercentageDifference=format_statistic(
+            get_difference(no_shows_statistic.average, no_shows_statistic.previous_average), no_shows_missing
+        ),
+        CallsInTime=calls_numbers_dict,
+        ConsentsPercentage=format_statistic(consents_statistic.last, no_calls_made),
+        ConsentsPercentageDifference=format_statistic(consents_statistic.difference, consents_missing),
+        AverageConstentsPercentage=format_statistic(consents_statistic.average, no_calls_made),
+        AverageConstentsPercentageDifference=format_statistic(
+            get_difference(consents_statistic.average, consents_statistic.previous_average), no_calls_made
+        ),
+    )
+
+
+class SimulationEngine:
+    """
+    Keeps the simulated hospital state for a single day and moves it one day at a time.
+    A checkpoint is stored for every simulated day, so a rollback restores it directly
+    and advancing again reuses it as long as consents of the previous day did not change.
+    No-shows are drawn per (day, queue entry), so they do not depend on how the day was reached.
+    """
+
+    def __init__(self, data: HospitalData):
+        self.data = data
+        self.beds_number = len(data.bed_departments)
+        self.queue_positions = {entry.entry_id: position for position, entry in enumerate(data.queue)}
+        self.no_show_sampler = NoShowSampler(NO_SHOW_SEED, NO_SHOW_PROBABILITY_TRUE_COUNT)
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Puts the engine back to the first day of the simulation and drops all checkpoints.
+        """
+        self.day = 1
+        self.init_beds()
+        self.queue_index = QueuePositionIndex([entry.queue_id for entry in self.data.queue])
+
+        self.occupancy_in_time = {"Date": [1], "Occupancy": [100]}
+        self.occupancy_statistic = DailyStatistic().add(100)
+        self.no_shows_in_time = {"Date": [1], "NoShowsNumber": [0]}
+        self.no_shows_statistic = DailyStatistic().add(0)
+        stay_lengths = [stay.days_of_stay for stay in self.data.stays.values()]
+        self.stay_length_statistic = GroupedStatistic(
+            groups=1, last_day=1, last_count=len(stay_lengths), last_total=sum(stay_lengths)
+        )
+        self.applied_consents: Dict[int, List[int]] = {1: []}
+
+        self.free_beds_at_day_start = self.free_beds_number()
+        self.no_shows_list: List[NoShow] = []
+        self.days_of_stay_for_replacement: List[int] = []
+        self.personnels_for_replacement: List[Dict[str, str]] = []
+        self.departments_for_replacement: List[str] = []
+
+        self.checkpoints: Dict[int, DayCheckpoint] = {1: self.create_checkpoint(())}
+
+    def create_checkpoint(self, previous_day_consents: Tuple[int, ...]) -> DayCheckpoint:
+        """
+        Captures the state of the current day, it has to be called before any consent of that day is applied.
+        :param previous_day_consents: Consents applied on the previous day, the state depends on them.
+        :return: Checkpoint of the current day.
+        """
+        return DayCheckpoint(
+            day=self.day,
+            previous_day_consents=previous_day_consents,
+            beds=self.snapshot_beds(),
+            queue=self.queue_index.snapshot(),
+            free_beds_at_day_start=self.free_beds_at_day_start,
+            occupancy=self.occupancy_in_time["Occupancy"][-1],
+            occupancy_statistic=self.occupancy_statistic,
+            no_shows_number=self.no_shows_in_time["NoShowsNumber"][-1],
+            no_shows_statistic=self.no_shows_statistic,
+            stay_length_statistic=self.stay_length_statistic,
+            no_shows=tuple(self.no_shows_list),
+            days_of_stay_for_replacement=tuple(self.days_of_stay_for_replacement),
+            personnels_for_replacement=tuple(self.personnels_for_replacement),
+            departments_for_replacement=tuple(self.departments_for_replacement),
+        )
+
+    def restore_checkpoint(self, day: int) -> None:
+        """
+        Restores the state of the given day from its checkpoint, consents of that day have to be applied again.
+        Statistics of the days before it are kept, so the checkpoint has to belong to the current history.
+        :param day: Day of the checkpoint to restore.
+        """
+        checkpoint = self.checkpoints[day]
+        self.day = day
+
+        self.restore_beds(checkpoint.beds)
+        self.queue_index.restore(checkpoint.queue)
+        self.free_beds_at_day_start = checkpoint.free_beds_at_day_start
+
+        for series in (self.occupancy_in_time, self.no_shows_in_time):
+            for values in series.values():
+                del values[day - 1 :]
+        self.occupancy_in_time["Date"].append(day)
+        self.occupancy_in_time["Occupancy"].append(checkpoint.occupancy)
+        self.no_shows_in_time["Date"].append(day)
+        self.no_shows_in_time["NoShowsNumber"].append(checkpoint.no_shows_number)
+        self.occupancy_statistic = checkpoint.occupancy_statistic
+        self.no_shows_statistic = checkpoint.no_shows_statistic
+        self.stay_length_statistic = checkpoint.stay_length_statistic
+
+        for past_day in [d for d in self.applied_consents if d >= day]:
+            del self.applied_consents[past_day]
+        self.applied_consents[day] = []
+
+        self.no_shows_list = list(checkpoint.no_shows)
+        self.days_of_stay_for_replacement = list(checkpoint.days_of_stay_for_replacement)
+        self.personnels_for_replacement = list(checkpoint.personnels_for_replacement)
+        self.departments_for_replacement = list(checkpoint.departments_for_replacement)
+
+    def advance(self, log: bool) -> None:
+        """
+        Moves to the next day, reusing its checkpoint when it was made after the same consents of the current day.
+        :param log: Whether to log releases, no-shows and admissions of the next day.
+        """
+        previous_day_consents = tuple(self.applied_consents[self.day])
+        checkpoint = self.checkpoints.get(self.day + 1)
+        if checkpoint is not None and checkpoint.previous_day_consents == previous_day_consents:
+            self.restore_checkpoint(self.day + 1)
+            return
+
+        self.step(log)
+        for later_day in [d for d in self.checkpoints if d >= self.day]:
+            del self.checkpoints[later_day]
+        self.checkpoints[self.day] = self.create_checkpoint(previous_day_consents)
+
+    def get_checkpoints_statistics(self) -> Dict[str, Union[int, Dict[int, int]]]:
+        """
+        Reports how many checkpoints are stored and how much memory they take.
+        :return: Dictionary with the current day, number of checkpoints and their sizes in bytes per day.
+        """
+        sizes = {
+            day: checkpoint.size_in_bytes() + self.beds_size_in_bytes(checkpoint.beds)
+            for day, checkpoint in sorted(self.checkpoints.items())
+        }
+        return {
+            "day": self.day,
+            "checkpoints_number": len(sizes),
+            "checkpoints_size_in_bytes": sum(sizes.values()),
+            "checkpoint_sizes_in_bytes": sizes,
+        }
+
+    def get_patient_name_by_id(self, patient_id: int) -> str:
+        patient = self.data.patients.get(patient_id)
+        return patient.name if patient else "Unknown"
+
+    def get_personnel_data(self, personnel_ids: List[int]) -> Dict[str, str]:
+        return {self.data.personnel[member_id].name: self.data.personnel[member_id].role for member_id in personnel_ids}
+
+    def init_beds(self) -> None:
+        """
+        Sets up bed state from the bed assignments read from the database.
+        """
+        self.stays = {
+            bed_id: StayRecord(s.patient_id, s.procedure_id, s.days_of_stay, s.personnel_ids)
+            for bed_id, s in self.data.stays.items()
+        }
+        self.free_bed_index = FreeBedIndex(self.data.bed_departments, self.stays.keys())
+        self.count_beds_per_patient()
+
+    def snapshot_beds(self) -> tuple:
+        """
+        :return: Immutable copy of bed state, it can be passed to restore_beds later.
+        """
+        stays = tuple(
+            (bed_id, stay.patient_id, stay.procedure_id, stay.days_of_stay, stay.personnel_ids)
+            for bed_id, stay in self.stays.items()
+        )
+        return stays, self.free_bed_index.snapshot()
+
+    def restore_beds(self, snapshot: tuple) -> None:
+        """
+        Brings back bed state saved with snapshot_beds.
+        :param snapshot: Result of an earlier snapshot_beds call.
+        """
+        stays, free_beds = snapshot
+        self.stays = {
+            bed_id: StayRecord(patient_id, procedure_id, days_of_stay, personnel_ids)
+            for bed_id, patient_id, procedure_id, days_of_stay, personnel_ids in stays
+        }
+        self.free_bed_index.restore(free_beds)
+        self.count_beds_per_patient()
+
+    def beds_size_in_bytes(self, snapshot: tuple) -> int:
+        """
+        :param snapshot: Result of an earlier snapshot_beds call.
+        :return: Approximate memory taken by the snapshot in bytes.
+        """
+        stays, free_beds = snapshot
+        size = sys.getsizeof(stays) + sum(sys.getsizeof(stay) for stay in stays)
+        return size + sys.getsizeof(free_beds) + sum(sys.getsizeof(beds) for beds in free_beds.values())
+
+    def free_beds_number(self) -> int:
+        return self.free_bed_index.free_count()
+
+    def occupied_beds_number(self) -> int:
+        return self.free_bed_index.occupied_count()
+
+    def get_stay(self, bed_id: int) -> Optional[StayRecord]:
+        return self.stays.get(bed_id)
+
+    def count_beds_per_patient(self) -> None:
+        """
+        Rebuilds the number of occupied beds per patient from the current stays.
+        """
+        self.beds_per_patient: Dict[int, int] = {}
+        for stay in self.stays.values():
+            self.beds_per_patient[stay.patient_id] = self.beds_per_patient.get(stay.patient_id, 0) + 1
+
+    def check_if_patient_has_bed(self, patient_id: int) -> bool:
+        return patient_id in self.beds_per_patient
+
+    def release_bed(self, bed_id: int) -> None:
+        patient_id = self.stays.pop(bed_id).patient_id
+        if self.beds_per_patient[patient_id] == 1:
+            del self.beds_per_patient[patient_id]
+        else:
+            self.beds_per_patient[patient_id] -= 1
+        self.free_bed_index.release(bed_id)
+
+    def find_queue_entry(self, queue_id: int) -> Optional[QueueEntryRecord]:
+        position = self.queue_index.find_by_place(queue_id)
+        return self.data.queue[position] if position is not None else None
+
+    def delete_patient_from_queue(self, entry: QueueEntryRecord) -> None:
+        self.queue_index.remove(self.queue_positions[entry.entry_id])
+
+    def occupy_bed(self, entry: QueueEntryRecord) -> int:
+        """
+        Puts the patient of the queue entry into the free bed with the lowest id in the entry's department.
+        :param entry: Admitted queue entry.
+        :return: Id of the occupied bed.
+        """
+        bed_id = self.free_bed_index.allocate(entry.department_id)
+        self.stays[bed_id] = StayRecord(entry.patient_id, entry.procedure_id, entry.days_of_stay, entry.personnel_ids)
+        self.beds_per_patient[entry.patient_id] = self.beds_per_patient.get(entry.patient_id, 0) + 1
+        return bed_id
+
+    def assign_bed_to_patient(self, entry: QueueEntryRecord, log: bool) -> None:
+        bed_id = self.occupy_bed(entry)
+        self.delete_patient_from_queue(entry)
+
+        self.record_stay_length(entry.days_of_stay)
+
+        if log:
+            logger.info(f"Assigned bed {bed_id} to patient {entry.patient_id} for {entry.days_of_stay} days")
+
+    def log_released_patients(self, patient_ids: List[int]) -> None:
+        if patient_ids:
+            logger.info(
+                "Patients to be released from hospital:\n"
+                + "\n".join(
+                    f"Patient ID: {patient_id}, Name: {self.get_patient_name_by_id(patient_id)}" for patient_id in patient_ids
+                )
+            )
+
+    def release_finished_stays(self, log: bool) -> None:
+        """
+        Shortens every stay by one day and frees beds of patients whose stay is over.
+        :param log: Whether to log the released patients.
+        """
+        for stay in self.stays.values():
+            stay.days_of_stay -= 1
+
+        released_beds = [bed_id for bed_id, stay in self.stays.items() if stay.days_of_stay <= 0]
+        if log:
+            self.log_released_patients([self.stays[bed_id].patient_id for bed_id in released_beds])
+        for bed_id in released_beds:
+            self.release_bed(bed_id)
+
+    def step(self, log: bool) -> None:
+        """
+        Simulates the next day: releases patients, draws no-shows and admits patients from that day's queue.
+        Consent admissions of the new day are applied separately with apply_consents.
+        :param log: Whether to log releases, no-shows and admissions of this day.
+        """
+        self.day += 1
+        self.applied_consents[self.day] = []
+
+        self.release_finished_stays(log)
+
+        self.free_beds_at_day_start = self.free_beds_number()
+        no_shows_number = 0
+
+        day_queue = [
+            self.data.queue[position]
+            for position in self.data.admission_day_index.entries_for_day(self.day)
+            if self.queue_index.contains(position)
+        ]
+
+        self.no_shows_list = []
+        self.days_of_stay_for_replacement = []
+        self.personnels_for_replacement = []
+        self.departments_for_replacement = []
+
+        expected_entries = day_queue[: self.free_beds_at_day_start]
+        no_shows = self.no_show_sampler.draw_no_shows(self.day, (entry.entry_id for entry in expected_entries))
+
+        for entry, is_no_show in zip(expected_entries, no_shows):
+            patient_id = entry.patient_id
+            if is_no_show:
+                no_shows_number += 1
+
+                self.days_of_stay_for_replacement.append(entry.days_of_stay)
+                self.personnels_for_replacement.append(entry.personnel)
+                self.departments_for_replacement.append(entry.department)
+
+                self.delete_patient_from_queue(entry)
+                no_show = NoShow(patient_id=patient_id, patient_name=self.get_patient_name_by_id(patient_id))
+                self.no_shows_list.append(no_show)
+                if log:
+                    logger.info(f"No-show: {no_show.patient_name}")
+            elif self.check_if_patient_has_bed(patient_id):
+                if log:
+                    logger.info(f"Patient {patient_id} already has a bed")
+            else:
+                self.assign_bed_to_patient(entry, log)
+
+        self.record_day_statistics(self.occupied_beds_number(), no_shows_number)
+
+    def record_day_statistics(self, occupied_beds_number: int, no_shows_number: int) -> None:
+        """
+        Appends occupancy and no-shows of the simulated day to their series and running statistics.
+        :param occupied_beds_number: Number of occupied beds at the end of the day.
+        :param no_shows_number: Number of expected patients who did not come.
+        """
+        occupancy = occupied_beds_number / self.beds_number * 100
+        self.occupancy_in_time["Date"].append(self.day)
+        self.occupancy_in_time["Occupancy"].append(occupancy)
+        self.occupancy_statistic = self.occupancy_statistic.add(occupancy)
+
+        self.no_shows_in_time["Date"].append(self.day)
+        self.no_shows_in_time["NoShowsNumber"].append(no_shows_number)
+        no_shows_percentage = no_shows_number / self.free_beds_at_day_start * 100 if self.free_beds_at_day_start > 0 else None
+        self.no_shows_statistic = self.no_shows_statistic.add(no_shows_percentage)
+
+    def update_occupancy(self, occupied_beds_number: int) -> None:
+        """
+        Updates occupancy of the current day after consented patients were admitted.
+        :param occupied_beds_number: Number of occupied beds.
+        """
+        occupancy = occupied_beds_number / self.beds_number * 100
+        self.occupancy_in_time["Occupancy"][-1] = occupancy
+        self.occupancy_statistic = self.occupancy_statistic.replace_last(occupancy)
+
+    def record_stay_length(self, days_of_stay: int) -> None:
+        """
+        :param days_of_stay: Length of the stay of a patient admitted on the current day.
+        """
+        self.stay_length_statistic = self.stay_length_statistic.add(self.day, days_of_stay)
+
+    def apply_consents(self, queue_ids: List[int], log: bool) -> None:
+        """
+        Admits patients who agreed to come on the current day and were not admitted yet.
+        :param queue_ids: All places in queue consented for the current day, in the order the consents were given.
+        :param log: Whether to log the admissions.
+        """
+        if self.day == 1:
+            return
+
+        applied = self.applied_consents[self.day]
+        for queue_id in queue_ids[len(applied) :]:
+            queue_entry = self.find_queue_entry(queue_id)
+            if self.check_if_patient_has_bed(queue_entry.patient_id):
+                if log:
+                    logger.info(f"Patient {queue_entry.patient_id} already has a bed")
+            else:
+                self.assign_bed_to_patient(queue_entry, log)
+            applied.append(queue_id)
+
+        self.update_occupancy(self.occupied_beds_number())
+
+    def find_diverged_day(self, consent_dict: Dict[int, List[int]]) -> Optional[int]:
+        """
+        Finds the first simulated day whose applied consents no longer match the requested ones.
+        :param consent_dict: Place in queue of patients who agreed to come earlier, per simulation day.
+        :return: The first day that has to be simulated again, or None if the state is still valid.
+        """
+        for day in range(2, self.day + 1):
+            applied = self.applied_consents[day]
+            requested = consent_dict.get(day, [])
+            if requested[: len(applied)] != applied or day < self.day and len(requested) != len(applied):
+                return day
+        return None
+
+    def sync(self, day: int, consent_dict: Dict[int, List[int]], log: bool) -> None:
+        """
+        Moves the engine to the requested day, restoring checkpoints instead of simulating days again when possible.
+        :param day: Simulation day to compute the state for.
+        :param consent_dict: Place in queue of patients who agreed to come earlier, per simulation day.
+        :param log: Whether to log the events of the requested day.
+        """
+        diverged_day = self.find_diverged_day(consent_dict)
+        if day < self.day:
+            logger.info(f"Rollback of simulation to day {day}")
+            self.restore_checkpoint(day if diverged_day is None else min(day, diverged_day))
+        elif diverged_day is not None:
+            self.restore_checkpoint(diverged_day)
+
+        valid_day = self.day
+        try:
+            while self.day < day:
+                self.apply_consents(consent_dict[self.day], log=False)
+                step_log = log and self.day + 1 == day
+                if step_log:
+                    logger.info(f"Current simulation day: {day}")
+                self.advance(step_log)
+                valid_day = self.day
+
+            self.apply_consents(consent_dict[self.day], log)
+        except Exception:
+            self.recover(valid_day)
+            raise
+
+    def recover(self, day: int) -> None:
+        """
+        Brings the engine back to a consistent state after simulating failed halfway through a day, so the next
+        sync starts from a valid state. Consents of the restored day are dropped and applied again by that sync.
+        :param day: Last day whose checkpoint was reached by the failed sync.
+        """
+        if day in self.checkpoints:
+            logger.warning(f"Simulation failed, restoring the checkpoint of day {day}")
+            self.restore_checkpoint(day)
+        else:
+            logger.warning("Simulation failed, resetting the simulation")
+            self.reset()
+
+    def get_future_queue_entries(self, patient_ids: List[int], from_day: int) -> List[Dict[str, int]]:
+        """
+        Lists queue entries of patients that are still waiting and are planned for the given day or later.
+        :param patient_ids: Ids of the patients.
+        :param from_day: First admission day to include.
+        :return: Patient id, place in queue, admission day and days of stay of every matching entry.
+        """
+        return [
+            {
+                "patient_id": patient_id,
+                "place_in_queue": self.queue_index.place_in_queue(position),
+                "admission_day": self.data.queue[position].admission_day,
+                "days_of_stay": self.data.queue[position].days_of_stay,
+            }
+            for patient_id in patient_ids
+            for position in self.data.admission_day_index.entries_for_patient(patient_id, from_day)
+            if self.queue_index.contains(position)
+        ]
+
+    def get_bed_assignment(self, bed_id: int) -> dict:
+        """
+        :param bed_id: Id of the bed.
+        :return: Assignment of the bed, with placeholders if it is free.
+        """
+        stay = self.get_stay(bed_id)
+        patient = self.data.patients.get(stay.patient_id) if stay else None
+        return {
+            "bed_id": bed_id,
+            "patient_id": stay.patient_id if stay else 0,
+            "patient_name": patient.name if patient else "Unoccupied",
+            "medical_procedure": self.data.procedures[stay.procedure_id].name if stay else "Unoccupied",
+            "pesel": patient.pesel if patient else "Unoccupied",
+            "nationality": patient.nationality if patient else "Unoccupied",
+            "days_of_stay": stay.days_of_stay if stay else 0,
+            "personnel": self.get_personnel_data(stay.personnel_ids) if stay else {},
+        }
+
+    def get_bed_assignments(self) -> Tuple[Dict[str, List[dict]], List[dict]]:
+        """
+        :return: Assignments of beds grouped by department name and assignments of all beds.
+        """
+        all_bed_assignments = []
+        department_assignments = {}
+        for bed_id, department_id in self.data.bed_departments.items():
+            assignment = self.get_bed_assignment(bed_id)
+            all_bed_assignments.append(assignment)
+
+            department_name = self.data.departments[department_id]
+            if department_name not in department_assignments:
+                department_assignments[department_name] = []
+
+            department_assignments[department_name].append(assignment)
+        return department_assignments, all_bed_assignments
+
+    def get_queue_table(self) -> List[dict]:
+        """
+        :return: Entries still waiting in the queue, ordered by place in queue.
+        """
+        return list(self.iter_queue_table())
+
+    def iter_queue_table(self) -> Iterator[dict]:
+        """
+        :return: Entries still waiting in the queue, ordered by place in queue, built one at a time.
+        """
+        for position, place_in_queue in self.queue_index.iter_places():
+            entry = self.data.queue[position]
+            patient = self.data.patients[entry.patient_id]
+            yield {
+                "place_in_queue": place_in_queue,
+                "patient_id": entry.patient_id,
+                "patient_name": patient.name,
+                "pesel": f"...{patient.pesel[-3:]}",
+                "nationality": patient.nationality,
+                "admission_day": entry.admission_day,
+                "days_of_stay": entry.days_of_stay,
+                "medical_procedure": entry.medical_procedure,
+                "department": entry.department,
+                "personnel": entry.personnel,
+            }
+
+    def get_replacement_data(self) -> Dict[str, list]:
+        """
+        :return: Days of stay, personnel and departments of freed places not yet taken by patients who consented.
+        """
+        consents_number = len(self.applied_consents[self.day]) if self.day > 1 else 0
+        return {
+            "DaysOfStay": self.days_of_stay_for_replacement[consents_number:],
+            "Personnels": self.personnels_for_replacement[consents_number:],
+            "Departments": self.departments_for_replacement[consents_number:],
+        }
+
+    def get_table_fields(
+        self, fields: Collection[str], consent_dict: Dict[int, List[int]], calls_numbers_dict: Dict[str, list]
+    ) -> Dict[str, Any]:
+        """
+        Builds only the selected parts of the response for the current day of the engine.
+        :param fields: Names of ListOfTables fields to build.
+        :param consent_dict: Place in queue of patients who agreed to come earlier, per simulation day.
+        :param calls_numbers_dict: Number of phone calls made per simulation day.
+        :return: Values of the selected fields, in the order of TABLE_FIELDS.
+        """
+        tables = {}
+        if "DepartmentAssignments" in fields or "AllBedAssignments" in fields:
+            tables["DepartmentAssignments"], tables["AllBedAssignments"] = self.get_bed_assignments()
+        if "PatientQueue" in fields:
+            tables["PatientQueue"] = self.get_queue_table()
+        if "NoShows" in fields:
+            tables["NoShows"] = [n.model_dump() for n in self.no_shows_list]
+        if "Statistics" in fields:
+            tables["Statistics"] = calculate_statistics(
+                self.stay_length_statistic,
+                {key: values.copy() for key, values in self.occupancy_in_time.items()},
+                self.occupancy_statistic,
+                {key: values.copy() for key, values in self.no_shows_in_time.items()},
+                self.no_shows_statistic,
+                get_consents_statistic(consent_dict, calls_numbers_dict),
+                calls_numbers_dict,
+            ).model_dump()
+        if "ReplacementData" in fields:
+            tables["ReplacementData"] = self.get_replacement_data()
+        return {name: tables[name] for name in TABLE_FIELDS if name in fields}
+
+    def iter_table_fields(
+        self, fields: Collection[str], consent_dict: Dict[int, List[int]], calls_numbers_dict: Dict[str, list]
+    ) -> Dict[str, Any]:
+        """
+        Same as get_table_fields, but bed and queue rows are given as iterators building them one at a time,
+        so a large response can be serialized without holding all of its rows. The iterators read the current state
+        of the engine, they have to be consumed before the engine is used again.
+        :param fields: Names of ListOfTables fields to build.
+        :param consent_dict: Place in queue of patients who agreed to come earlier, per simulation day.
+        :param calls_numbers_dict: Number of phone calls made per simulation day.
+        :return: Values of the selected fields, in the order of TABLE_FIELDS.
+        """
+        tables = {}
+        if "DepartmentAssignments" in fields:
+            department_beds = {}
+            for bed_id, department_id in self.data.bed_departments.items():
+                department_beds.setdefault(self.data.departments[department_id], []).append(bed_id)
+            tables["DepartmentAssignments"] = {
+                department_name: map(self.get_bed_assignment, bed_ids) for department_name, bed_ids in department_beds.items()
+            }
+        if "AllBedAssignments" in fields:
+            tables["AllBedAssignments"] = map(self.get_bed_assignment, self.data.bed_departments)
+        if "PatientQueue" in fields:
+            tables["PatientQueue"] = self.iter_queue_table()
+        tables.update(
+            self.get_table_fields(
+                [name for name in ("NoShows", "Statistics", "ReplacementData") if name in fields],
+                consent_dict,
+                calls_numbers_dict,
+            )
+        )
+        return {name: tables[name] for name in TABLE_FIELDS if name in tables}
+
+    def get_normalized_table_fields(
+        self, fields: Collection[str], consent_dict: Dict[int, List[int]], calls_numbers_dict: Dict[str, list]
+    ) -> Dict[str, Any]:
+        """
+        Builds the selected parts of the normalized response for the current day of the engine. Beds are listed once
+        with the index of their department, departments, procedures and personnel members are dictionary-encoded.
+        Lookup tables are included whenever Beds or PatientQueue are selected.
+        :param fields: Names of NormalizedTables fields to build.
+        :param consent_dict: Place in queue of patients who agreed to come earlier, per simulation day.
+        :param calls_numbers_dict: Number of phone calls made per simulation day.
+        :return: Values of the selected fields, in the order of NORMALIZED_TABLE_FIELDS.
+        """
+        departments, procedures, personnel = DictionaryEncoder(), DictionaryEncoder(), DictionaryEncoder()
+        tables = {}
+        if "Beds" in fields:
+            beds = []
+            for bed_id, department_id in self.data.bed_departments.items():
+                stay = self.get_stay(bed_id)
+                patient = self.data.patients.get(stay.patient_id) if stay else None
+                beds.append(
+                    {
+                        "bed_id": bed_id,
+                        "department": departments.encode(self.data.departments[department_id]),
+                        "patient_id": stay.patient_id if stay else 0,
+                        "patient_name": patient.name if patient else "Unoccupied",
+                        "medical_procedure": procedures.encode(
+                            self.data.procedures[stay.procedure_id].name if stay else "Unoccupied"
+                        ),
+                        "pesel": patient.pesel if patient else "Unoccupied",
+                        "nationality": patient.nationality if patient else "Unoccupied",
+                        "days_of_stay": stay.days_of_stay if stay else 0,
+                        "personnel": [
+                            personnel.encode(member) for member in self.get_personnel_data(stay.personnel_ids).items()
+                        ]
+                        if stay
+                        else [],
+                    }
+                )
+            tables["Beds"] = beds
+        if "PatientQueue" in fields:
+            queue_data = []
+            for entry in self.iter_queue_table():
+                entry["medical_procedure"] = procedures.encode(entry["medical_procedure"])
+                entry["department"] = departments.encode(entry["department"])
+                entry["personnel"] = [personnel.encode(member) for member in entry["personnel"].items()]
+                queue_data.append(entry)
+            tables["PatientQueue"] = queue_data
+        if "Beds" in fields or "PatientQueue" in fields:
+            tables["Departments"] = departments.values
+            tables["Procedures"] = procedures.values
+            tables["Personnel"] = personnel.values
+        tables.update(
+            self.get_table_fields(
+                [name for name in ("NoShows", "Statistics", "ReplacementData") if name in fields],
+                consent_dict,
+                calls_numbers_dict,
+            )
+        )
+        return {name: tables[name] for name in NORMALIZED_TABLE_FIELDS if name in tables}
+
+    def get_tables(self, consent_dict: Dict[int, List[int]], calls_numbers_dict: Dict[str, list]) -> ListOfTables:
+        """
+        Builds the response for the current day of the engine.
+        :param consent_dict: Place in queue of patients who agreed to come earlier, per simulation day.
+        :param calls_numbers_dict: Number of phone calls made per simulation day.
+        :return: Tables of beds, queue and no-shows together with statistics and replacement data.
+        """
+        return ListOfTables(**self.get_table_fields(TABLE_FIELDS, consent_dict, calls_numbers_dict))
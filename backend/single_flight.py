@@ -0,0 +1,97 @@
+import asyncio
+from concurrent.futures import Future
+from threading import Lock
+from typing import Callable, Dict, Hashable, Optional, Tuple, TypeVar
+
+from fastapi.concurrency import run_in_threadpool
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the function, callers arriving while it runs
+    wait for its result instead of running it again. Exceptions are passed to every waiting caller and are not remembered.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.calls: Dict[Hashable, Future] = {}
+        self.computed = 0
+        self.coalesced = 0
+
+    def join(self, key: Hashable) -> Tuple[Future, bool]:
+        """
+        :param key: Identifier of the computation.
+        :return: Future of the computation and whether the caller has to run it.
+        """
+        with self.lock:
+            future = self.calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = Future()
+            self.calls[key] = future
+            self.computed += 1
+            return future, True
+
+    def finish(
+        self, key: Hashable, future: Future, result: Optional[T] = None, exception: Optional[BaseException] = None
+    ) -> None:
+        """
+        Passes the result or exception of a computation to its waiting callers.
+        :param key: Identifier of the computation.
+        :param future: Future returned by join.
+        :param result: Result of the computation.
+        :param exception: Exception raised by the computation, if any.
+        """
+        with self.lock:
+            del self.calls[key]
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def do(self, key: Hashable, function: Callable[[], T]) -> T:
+        """
+        :param key: Identifier of the computation, e.g. a state token.
+        :param function: Computation to run if no call with the same key is in flight.
+        :return: Result of the function, computed by this or by a concurrent caller.
+        """
+        future, is_leader = self.join(key)
+        if not is_leader:
+            return future.result()
+
+        try:
+            result = function()
+        except BaseException as e:
+            self.finish(key, future, exception=e)
+            raise
+        self.finish(key, future, result)
+        return result
+
+    async def do_async(self, key: Hashable, function: Callable[[], T]) -> T:
+        """
+        Same as do, but the function runs in the threadpool and waiting callers do not block the event loop or a thread.
+        :param key: Identifier of the computation, e.g. a state token.
+        :param function: Blocking computation to run if no call with the same key is in flight.
+        :return: Result of the function, computed by this or by a concurrent caller.
+        """
+        future, is_leader = self.join(key)
+        if not is_leader:
+            return await asyncio.wrap_future(future)
+
+        try:
+            result = await run_in_threadpool(function)
+        except BaseException as e:
+            self.finish(key, future, exception=e)
+            raise
+        self.finish(key, future, result)
+        return result
+
+    def get_statistics(self) -> Dict[str, int]:
+        """
+        :return: Dictionary with numbers of computed and coalesced calls and of calls in flight.
+        """
+        with self.lock:
+            return {"computed": self.computed, "coalesced": self.coalesced, "in_flight": len(self.calls)}
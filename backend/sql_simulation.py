@@ -0,0 +1,294 @@
+import logging
+from contextlib import AbstractContextManager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from db_operations import session_scope
+from indexes import FreeBedIndex, QueuePositionIndex
+from models import NoShow
+from simulation import HospitalData, SimulationEngine, StayRecord
+from sqlalchemy import Connection, text
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger("hospital_logger")
+
+CREATE_STAYS_TABLE = text(
+    """
+    CREATE TEMPORARY TABLE sim_stays ON COMMIT DROP AS
+    SELECT bed_id, patient_id, procedure_id, days_of_stay, CAST(NULL AS integer) AS entry_id
+    FROM bed_assignments
+    """
+)
+
+CREATE_QUEUE_TABLE = text(
+    """
+    CREATE TEMPORARY TABLE sim_queue ON COMMIT DROP AS
+    SELECT q.id AS entry_id, q.queue_id, q.patient_id, q.procedure_id, q.days_of_stay, q.admission_day, p.department_id
+    FROM patient_queue q
+    JOIN medical_procedures p ON p.procedure_id = q.procedure_id
+    """
+)
+
+CREATE_QUEUE_INDEX = text("CREATE INDEX ON sim_queue (admission_day, queue_id)")
+
+CREATE_NO_SHOW_DRAWS_TABLE = text(
+    """
+    CREATE TEMPORARY TABLE sim_no_show_draws ON COMMIT DROP AS
+    SELECT unnest(CAST(:entry_ids AS integer[])) AS entry_id
+    """
+)
+
+RELEASE_FINISHED_STAYS = text(
+    """
+    WITH released AS (
+        DELETE FROM sim_stays WHERE days_of_stay <= 1 RETURNING bed_id, patient_id
+    ), shortened AS (
+        UPDATE sim_stays SET days_of_stay = days_of_stay - 1 WHERE days_of_stay > 1
+    )
+    SELECT patient_id FROM released ORDER BY bed_id
+    """
+)
+
+ADMIT_DAY_QUEUE = text(
+    """
+    WITH expected AS (
+        SELECT q.entry_id, q.queue_id, q.patient_id, q.procedure_id, q.department_id, q.days_of_stay,
+               d.entry_id IS NOT NULL AS no_show
+        FROM sim_queue q
+        LEFT JOIN sim_no_show_draws d ON d.entry_id = q.entry_id
+        WHERE q.admission_day = :day
+        ORDER BY q.queue_id
+        LIMIT :free_beds
+    ), coming AS (
+        SELECT e.*,
+               row_number() OVER (PARTITION BY e.patient_id ORDER BY e.queue_id) AS patient_rank,
+               EXISTS (SELECT 1 FROM sim_stays s WHERE s.patient_id = e.patient_id) AS has_bed
+        FROM expected e
+        WHERE NOT e.no_show
+    ), admitted AS (
+        SELECT c.entry_id, c.patient_id, c.procedure_id, c.department_id, c.days_of_stay,
+               row_number() OVER (PARTITION BY c.department_id ORDER BY c.queue_id) AS department_rank
+        FROM coming c
+        WHERE NOT c.has_bed AND c.patient_rank = 1
+    ), free_beds AS (
+        SELECT b.bed_id, b.department_id,
+               row_number() OVER (PARTITION BY b.department_id ORDER BY b.bed_id) AS department_rank
+        FROM beds b
+        WHERE NOT EXISTS (SELECT 1 FROM sim_stays s WHERE s.bed_id = b.bed_id)
+    ), assigned AS (
+        INSERT INTO sim_stays (bed_id, patient_id, procedure_id, days_of_stay, entry_id)
+        SELECT f.bed_id, a.patient_id, a.procedure_id, a.days_of_stay, a.entry_id
+        FROM admitted a
+        JOIN free_beds f ON f.department_id = a.department_id AND f.department_rank = a.department_rank
+        RETURNING entry_id, bed_id
+    )
+    SELECT e.entry_id, e.patient_id, e.days_of_stay, e.no_show, a.entry_id IS NOT NULL AS admitted, s.bed_id
+    FROM expected e
+    LEFT JOIN admitted a ON a.entry_id = e.entry_id
+    LEFT JOIN assigned s ON s.entry_id = e.entry_id
+    ORDER BY e.queue_id
+    """
+)
+
+ADMIT_CONSENTED_PATIENT = text(
+    """
+    WITH entry AS (
+        SELECT entry_id, patient_id, procedure_id, department_id, days_of_stay FROM sim_queue WHERE queue_id = :queue_id
+    ), has_bed AS (
+        SELECT EXISTS (SELECT 1 FROM sim_stays s JOIN entry e ON s.patient_id = e.patient_id) AS has_bed
+    ), free_bed AS (
+        SELECT b.bed_id
+        FROM beds b
+        JOIN entry e ON b.department_id = e.department_id
+        WHERE NOT EXISTS (SELECT 1 FROM sim_stays s WHERE s.bed_id = b.bed_id)
+        ORDER BY b.bed_id
+        LIMIT 1
+    ), assigned AS (
+        INSERT INTO sim_stays (bed_id, patient_id, procedure_id, days_of_stay, entry_id)
+        SELECT f.bed_id, e.patient_id, e.procedure_id, e.days_of_stay, e.entry_id
+        FROM entry e, free_bed f
+        WHERE NOT (SELECT has_bed FROM has_bed)
+        RETURNING bed_id
+    )
+    SELECT e.entry_id, e.patient_id, e.days_of_stay, h.has_bed, (SELECT bed_id FROM assigned) AS bed_id
+    FROM entry e, has_bed h
+    """
+)
+
+REMOVE_FROM_QUEUE = text(
+    """
+    WITH removed AS (
+        DELETE FROM sim_queue WHERE entry_id = ANY(:entry_ids) RETURNING queue_id
+    )
+    UPDATE sim_queue q
+    SET queue_id = q.queue_id - (SELECT count(*) FROM removed r WHERE r.queue_id < q.queue_id)
+    WHERE q.entry_id <> ALL(:entry_ids) AND q.queue_id > (SELECT min(queue_id) FROM removed)
+    """
+)
+
+SELECT_STAYS = text("SELECT bed_id, patient_id, procedure_id, days_of_stay, entry_id FROM sim_stays")
+
+SELECT_QUEUE = text("SELECT entry_id FROM sim_queue")
+
+
+class SqlSimulationEngine(SimulationEngine):
+    """
+    Simulation engine running the day loop inside PostgreSQL with set-based statements on temporary tables.
+    A simulated day takes three statements: releasing finished stays, handling that day's arrivals, where no-shows come
+    from a precomputed draw table and free beds are matched with admitted patients by window functions, and renumbering
+    the queue. Every consent adds two more. The final state is read back into the structures of SimulationEngine,
+    so get_tables gives the same response as the in-memory engines. The temporary tables are dropped with the transaction,
+    nothing is persisted.
+    """
+
+    def __init__(self, data: HospitalData, session_factory: Callable[[], AbstractContextManager[Session]] = session_scope):
+        """
+        :param data: Hospital data used to build responses, the day loop itself reads the database tables.
+        :param session_factory: Context manager factory providing a session that is rolled back afterwards.
+        """
+        super().__init__(data)
+        self.session_factory = session_factory
+        self.no_show_entry_ids = [
+            entry.entry_id for entry in data.queue if self.no_show_sampler.is_no_show(entry.admission_day, entry.entry_id)
+        ]
+        self.synced_state: Optional[Tuple[int, Dict[int, List[int]]]] = None
+
+    def sync(self, day: int, consent_dict: Dict[int, List[int]], log: bool) -> None:
+        """
+        Simulates all days up to the requested one in the database, unless that exact state was computed last time.
+        :param day: Simulation day to compute the state for.
+        :param consent_dict: Place in queue of patients who agreed to come earlier, per simulation day.
+        :param log: Whether to log the events of the requested day.
+        """
+        requested_state = (day, {consent_day: list(consent_dict[consent_day]) for consent_day in range(1, day + 1)})
+        if requested_state == self.synced_state:
+            return
+        if day < self.day:
+            logger.info(f"Rollback of simulation to day {day}")
+
+        self.synced_state = None
+        self.reset()
+        with self.session_factory() as session:
+            connection = session.connection()
+            connection.execute(CREATE_STAYS_TABLE)
+            connection.execute(CREATE_QUEUE_TABLE)
+            connection.execute(CREATE_QUEUE_INDEX)
+            connection.execute(CREATE_NO_SHOW_DRAWS_TABLE, {"entry_ids": self.no_show_entry_ids})
+            self.occupied_beds = len(self.data.stays)
+
+            while self.day < day:
+                day_log = log and self.day + 1 == day
+                if day_log:
+                    logger.info(f"Current simulation day: {day}")
+                self.simulate_day(connection, day_log)
+                self.admit_consented_patients(connection, consent_dict[self.day], day_log)
+
+            self.load_state(connection)
+        self.synced_state = requested_state
+
+    def simulate_day(self, connection: Connection, log: bool) -> None:
+        """
+        Simulates the next day: releases patients, draws no-shows and admits patients from that day's queue.
+        :param connection: Connection holding the temporary simulation tables.
+        :param log: Whether to log releases, no-shows and admissions of this day.
+        """
+        self.day += 1
+        self.applied_consents[self.day] = []
+
+        released_patients = connection.execute(RELEASE_FINISHED_STAYS).scalars().all()
+        if log:
+            self.log_released_patients(released_patients)
+        self.occupied_beds -= len(released_patients)
+        self.free_beds_at_day_start = self.beds_number - self.occupied_beds
+
+        self.no_shows_list = []
+        self.days_of_stay_for_replacement = []
+        self.personnels_for_replacement = []
+        self.departments_for_replacement = []
+        removed_entries = []
+
+        rows = connection.execute(ADMIT_DAY_QUEUE, {"day": self.day, "free_beds": self.free_beds_at_day_start}).all()
+        for row in rows:
+            if row.no_show:
+                entry = self.data.queue[self.queue_positions[row.entry_id]]
+                self.days_of_stay_for_replacement.append(entry.days_of_stay)
+                self.personnels_for_replacement.append(entry.personnel)
+                self.departments_for_replacement.append(entry.department)
+
+                no_show = NoShow(patient_id=row.patient_id, patient_name=self.get_patient_name_by_id(row.patient_id))
+                self.no_shows_list.append(no_show)
+                if log:
+                    logger.info(f"No-show: {no_show.patient_name}")
+            elif row.admitted:
+                self.record_admission(row.bed_id, row.patient_id, row.days_of_stay, log)
+            elif log:
+                logger.info(f"Patient {row.patient_id} already has a bed")
+
+            if row.no_show or row.admitted:
+                removed_entries.append(row.entry_id)
+
+        if removed_entries:
+            connection.execute(REMOVE_FROM_QUEUE, {"entry_ids": removed_entries})
+
+        self.record_day_statistics(self.occupied_beds, len(self.no_shows_list))
+
+    def admit_consented_patients(self, connection: Connection, queue_ids: List[int], log: bool) -> None:
+        """
+        Admits patients who agreed to come on the current day, one statement pair per consent in the order they were given.
+        Consents given on the first day are ignored, like in SimulationEngine.apply_consents.
+        :param connection: Connection holding the temporary simulation tables.
+        :param queue_ids: All places in queue consented for the current day.
+        :param log: Whether to log the admissions.
+        """
+        if self.day == 1:
+            return
+
+        for queue_id in queue_ids:
+            row = connection.execute(ADMIT_CONSENTED_PATIENT, {"queue_id": queue_id}).first()
+            if row is None:
+                raise LookupError(f"No patient at place {queue_id} in queue")
+            if row.has_bed:
+                if log:
+                    logger.info(f"Patient {row.patient_id} already has a bed")
+            else:
+                self.record_admission(row.bed_id, row.patient_id, row.days_of_stay, log)
+                connection.execute(REMOVE_FROM_QUEUE, {"entry_ids": [row.entry_id]})
+            self.applied_consents[self.day].append(queue_id)
+
+        self.update_occupancy(self.occupied_beds)
+
+    def record_admission(self, bed_id: Optional[int], patient_id: int, days_of_stay: int, log: bool) -> None:
+        """
+        Updates statistics after the database assigned a bed to a patient.
+        :param bed_id: Assigned bed, None if the patient's department had no free bed.
+        :param patient_id: Id of the admitted patient.
+        :param days_of_stay: Length of the stay.
+        :param log: Whether to log the admission.
+        :raises IndexError: If no bed was assigned, like allocating from an empty department does in memory.
+        """
+        if bed_id is None:
+            raise IndexError(f"No free bed for patient {patient_id}")
+        self.occupied_beds += 1
+        self.record_stay_length(days_of_stay)
+        if log:
+            logger.info(f"Assigned bed {bed_id} to patient {patient_id} for {days_of_stay} days")
+
+    def load_state(self, connection: Connection) -> None:
+        """
+        Reads final bed assignments and queue from the temporary tables into the in-memory structures used by get_tables.
+        :param connection: Connection holding the temporary simulation tables.
+        """
+        self.stays = {}
+        for bed_id, patient_id, procedure_id, days_of_stay, entry_id in connection.execute(SELECT_STAYS):
+            if entry_id is None:
+                personnel_ids = self.data.stays[bed_id].personnel_ids
+            else:
+                personnel_ids = self.data.queue[self.queue_positions[entry_id]].personnel_ids
+            self.stays[bed_id] = StayRecord(patient_id, procedure_id, days_of_stay, personnel_ids)
+        self.free_bed_index = FreeBedIndex(self.data.bed_departments, self.stays.keys())
+        self.count_beds_per_patient()
+
+        remaining_entries = set(connection.execute(SELECT_QUEUE).scalars())
+        self.queue_index = QueuePositionIndex([entry.queue_id for entry in self.data.queue])
+        for position, entry in enumerate(self.data.queue):
+            if entry.entry_id not in remaining_entries:
+                self.queue_index.remove(position)
@@ -0,0 +1,225 @@
+import copy
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import cached_property
+from threading import Lock
+from typing import Callable, Dict, List
+
+from response_cache import get_state_token
+from sqlalchemy import BigInteger, Column, Float, MetaData, String, Table, create_engine, delete, event, select, update
+from sqlalchemy.exc import IntegrityError
+
+
+@dataclass
+class SimulationState:
+    """
+    Control state of the simulation set by the frontend. Loaded states are shared between requests and must not be
+    modified, StateStore.update works on a copy.
+    """
+
+    day: int = 1
+    last_change: int = 1
+    consents: Dict[int, List[int]] = field(default_factory=lambda: {1: []})
+    calls: Dict[str, list] = field(default_factory=lambda: {"Date": [1], "CallsNumber": [0]})
+    version: int = 0
+
+    @cached_property
+    def token(self) -> str:
+        return get_state_token(self.day, self.last_change, self.consents, self.calls)
+
+    def copy(self) -> "SimulationState":
+        """
+        :return: Deep copy of the state, without the cached token.
+        """
+        return SimulationState(
+            self.day, self.last_change, copy.deepcopy(self.consents), copy.deepcopy(self.calls), self.version
+        )
+
+    def to_json(self) -> str:
+        return json.dumps({"day": self.day, "last_change": self.last_change, "consents": self.consents, "calls": self.calls})
+
+    @classmethod
+    def from_json(cls, data: str, version: int) -> "SimulationState":
+        values = json.loads(data)
+        return cls(
+            day=values["day"],
+            last_change=values["last_change"],
+            consents={int(day): queue_ids for day, queue_ids in values["consents"].items()},
+            calls=values["calls"],
+            version=version,
+        )
+
+
+StateUpdate = Callable[[SimulationState], bool]
+
+
+def get_initial_version() -> int:
+    """
+    Versions of a state start from the current time in milliseconds instead of 1. An expired state starts again from
+    the initial state, and its new versions must not repeat versions that clients of the session may still have.
+    :return: Version of the first update of a state.
+    """
+    return int(time.time() * 1000)
+
+
+class StateStore:
+    """
+    Keeps the simulation state of every session and applies updates atomically, every applied update increments
+    the version of the session's state. Sessions that were never updated are in the initial state, and so are sessions
+    whose state expired after it was not updated for too long or too many other states were updated after it.
+    """
+
+    blocking = False
+
+    def load(self, session_id: str) -> SimulationState:
+        raise NotImplementedError
+
+    def update(self, session_id: str, function: StateUpdate) -> SimulationState:
+        """
+        :param session_id: Id of the simulation session.
+        :param function: Modifies the given copy of the state in place and returns whether it changed anything.
+            It may be called more than once, so it must not have other side effects.
+        :return: State after the update.
+        """
+        raise NotImplementedError
+
+
+class InMemoryStateStore(StateStore):
+    """
+    State kept in the memory of this process, it is only correct with a single worker. States are kept when sessions
+    are evicted, so an evicted session continues from the same day and version. The least recently updated states
+    are dropped while there are too many of them or they were not updated for longer than the timeout.
+    """
+
+    def __init__(self, max_states: int, idle_timeout: float):
+        """
+        :param max_states: Maximum number of states kept.
+        :param idle_timeout: Seconds after the last update when a state is dropped.
+        """
+        self.lock = Lock()
+        self.max_states = max_states
+        self.idle_timeout = idle_timeout
+        self.states: OrderedDict[str, SimulationState] = OrderedDict()
+        self.updated_at: Dict[str, float] = {}
+
+    def load(self, session_id: str) -> SimulationState:
+        state = self.states.get(session_id)
+        return state if state is not None else SimulationState()
+
+    def update(self, session_id: str, function: StateUpdate) -> SimulationState:
+        with self.lock:
+            state = self.load(session_id).copy()
+            if function(state):
+                state.version = state.version + 1 if state.version else get_initial_version()
+                now = time.monotonic()
+                self.states[session_id] = state
+                self.states.move_to_end(session_id)
+                self.updated_at[session_id] = now
+                self.expire(now)
+            return self.load(session_id)
+
+    def expire(self, now: float) -> None:
+        """
+        Drops the least recently updated states over the limits. Must be called with the lock held.
+        :param now: Current time.
+        """
+        while self.states:
+            session_id = next(iter(self.states))
+            if len(self.states) <= self.max_states and now - self.updated_at[session_id] <= self.idle_timeout:
+                break
+            del self.states[session_id]
+            del self.updated_at[session_id]
+
+
+class SqlStateStore(StateStore):
+    """
+    States kept in rows of a database table, so they can be shared by many worker processes. States of evicted sessions
+    stay in the table like in InMemoryStateStore. Rows over the limits are deleted by the worker that updates a state
+    first after EXPIRE_INTERVAL seconds since its last check.
+    Updates use optimistic locking on the version column and are retried when another worker updated the row first.
+    SQLite databases are switched to WAL mode, so readers do not wait for writers.
+    """
+
+    blocking = True
+    EXPIRE_INTERVAL = 60
+    metadata = MetaData()
+    table = Table(
+        "simulation_state",
+        metadata,
+        Column("session_id", String, primary_key=True),
+        Column("version", BigInteger, nullable=False),
+        Column("state", String, nullable=False),
+        Column("updated_at", Float, nullable=False, index=True),
+    )
+
+    def __init__(self, url: str, max_states: int, idle_timeout: float):
+        """
+        :param url: SQLAlchemy URL of the database, e.g. PostgreSQL of the hospital or a SQLite file.
+        :param max_states: Maximum number of states kept.
+        :param idle_timeout: Seconds after the last update when a state is deleted.
+        """
+        self.max_states = max_states
+        self.idle_timeout = idle_timeout
+        self.expired_at = 0.0
+        self.engine = create_engine(url, pool_pre_ping=True)
+        if self.engine.dialect.name == "sqlite":
+            event.listen(self.engine, "connect", self.enable_wal)
+        self.metadata.create_all(self.engine, checkfirst=True)
+
+    @staticmethod
+    def enable_wal(dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
+    def load(self, session_id: str) -> SimulationState:
+        with self.engine.connect() as connection:
+            row = connection.execute(
+                select(self.table.c.version, self.table.c.state).where(self.table.c.session_id == session_id)
+            ).one_or_none()
+        return SimulationState.from_json(row.state, row.version) if row is not None else SimulationState()
+
+    def update(self, session_id: str, function: StateUpdate) -> SimulationState:
+        while True:
+            state = self.load(session_id)
+            if not function(state):
+                return state
+            version = state.version + 1 if state.version else get_initial_version()
+            now = time.time()
+            try:
+                with self.engine.begin() as connection:
+                    if state.version == 0:
+                        connection.execute(
+                            self.table.insert().values(
+                                session_id=session_id, version=version, state=state.to_json(), updated_at=now
+                            )
+                        )
+                        updated = True
+                    else:
+                        result = connection.execute(
+                            update(self.table)
+                            .where(self.table.c.session_id == session_id, self.table.c.version == state.version)
+                            .values(version=version, state=state.to_json(), updated_at=now)
+                        )
+                        updated = result.rowcount == 1
+            except IntegrityError:
+                updated = False
+            if updated:
+                state.version = version
+                if now - self.expired_at >= self.EXPIRE_INTERVAL:
+                    self.expire(now)
+                return state
+
+    def expire(self, now: float) -> None:
+        """
+        Deletes states not updated for longer than the timeout and the least recently updated states over the limit.
+        :param now: Current time.
+        """
+        self.expired_at = now
+        kept = select(self.table.c.session_id).order_by(self.table.c.updated_at.desc()).limit(self.max_states)
+        with self.engine.begin() as connection:
+            connection.execute(delete(self.table).where(self.table.c.updated_at < now - self.idle_timeout))
+            connection.execute(delete(self.table).where(self.table.c.session_id.not_in(kept.scalar_subquery())))
@@ -1,9 +1,12 @@
 import gettext
+import json
+import uuid
 from datetime import date, datetime, timedelta
-from typing import Callable, Dict, Optional
+from typing import Callable, Dict, Optional, Tuple, Union
 
 import altair as alt
 import pandas as pd
+import pyarrow as pa
 import requests
 import streamlit as st
 from agent import *
@@ -12,6 +15,9 @@ from streamlit.delta_generator import DeltaGenerator
 from streamlit_autorefresh import st_autorefresh
 from translate import get_openai_client, translate
 
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+BACKEND_TIMEOUT = 30  # seconds
+
 for key, default in {
     "interface_language": "en",
     "phone_number": None,
@@ -23,6 +29,11 @@ for key, default in {
     "replacement_start_index": 0,
     "transcriptions": [],
     "voice_language": "nationality",
+    "tables": None,
+    "tables_version": None,
+    "state_version": None,
+    "responses": {},
+    "session_id": str(uuid.uuid4()),
 }.items():
     if key not in st.session_state:
         st.session_state[key] = default
@@ -50,7 +61,9 @@ ui_languages = ["en", "pl"]
 voice_languages = ["pl", "ua", "en", _("nationality")]
 
 if "day_for_simulation" not in st.session_state or st.session_state.day_for_simulation is None:
-    st.session_state.day_for_simulation = requests.get("http://backend:8000/get-current-day").json()["day"]
+    st.session_state.day_for_simulation = requests.get(
+        "http://backend:8000/get-current-day", params={"session_id": st.session_state.session_id}
+    ).json()["day"]
 
 if st.session_state.voice_language not in voice_languages:
     st.session_state.voice_language = _("nationality")
@@ -453,8 +466,8 @@ def agent_call(
     if call_results["called"] is False:
         main_tab.warning(_("It is necessary to fill in the field with the phone number in the settings section!"), icon="⚠️")
     elif consent is True:
-        requests.get("http://backend:8000/add-patient-to-approvers", params={"queue_id": idx + 1})
-        requests.get("http://backend:8000/increase-calls-number")
+        change_state("add-patient-to-approvers", {"queue_id": idx + 1})
+        change_state("increase-calls-number", {})
 
         main_tab.success(f"{name} {surname} {_('agreed to reschedule')}.")
 
@@ -466,7 +479,7 @@ def agent_call(
         main_tab.info(f"{name} {surname}{_("'s verification is unsuccessful")}.")
         st.session_state.consent = None
     elif consent is False:
-        requests.get("http://backend:8000/increase-calls-number")
+        change_state("increase-calls-number", {})
         main_tab.error(f"{name} {surname} {_('did not agree to reschedule')}.")
         st.session_state.phoned_ids.append(idx + 1)
         st.session_state.current_patient_index = find_next_patient_to_call(
@@ -528,14 +541,152 @@ def call_next_patient_in_queue(
     agent_call(queue_df, bed_df, searched_days_of_stay, department, personnel, agent_lang)
 
 
+def get_backend_data(
+    path: str, params: Dict, accept: str = "application/json"
+) -> Tuple[Optional[Union[Dict, pa.Table]], Optional[int]]:
+    """
+    The last response of every request is kept with its ETag and sent in If-None-Match, on 304 it is parsed again
+    instead of being transferred.
+    :param path: Path of the backend endpoint.
+    :param params: Query parameters.
+    :param accept: "application/json" or ARROW_STREAM for an Arrow table.
+    :return: Parsed JSON or Arrow table and the state version it belongs to, None if the request failed.
+    """
+    key = f"{path}?{sorted(params.items())}&{accept}"
+    etag, content = st.session_state.responses.get(key, (None, None))
+    headers = {"Accept": accept, **({"If-None-Match": etag} if etag else {})}
+    response = requests.get(f"http://backend:8000/{path}", params=params, headers=headers, timeout=BACKEND_TIMEOUT)
+    if response.status_code == 200:
+        content = response.content
+        st.session_state.responses[key] = (response.headers.get("ETag"), content)
+    elif response.status_code != 304 or content is None:
+        return None, None
+    data = pa.ipc.open_stream(content).read_all() if accept == ARROW_STREAM else json.loads(content)
+    return data, int(response.headers["X-State-Version"])
+
+
+def arrow_table_to_dataframe(table: pa.Table) -> pd.DataFrame:
+    """
+    Converts an Arrow table to a DataFrame, numeric columns without copying and dictionary-encoded columns
+    to categories. Personnel maps are turned into dictionaries.
+    :param table: Arrow table of beds or queue.
+    :return: DataFrame with the same columns.
+    """
+    df = table.to_pandas()
+    df["personnel"] = df["personnel"].map(dict)
+    return df
+
+
+def add_categories(df: pd.DataFrame, column: str, values: pd.Series) -> None:
+    """
+    Extends the categories of a categorical column, so the given values can be assigned to it.
+    :param df: DataFrame modified in place.
+    :param column: Name of the column.
+    :param values: Values to be assigned.
+    """
+    if isinstance(df[column].dtype, pd.CategoricalDtype):
+        new_categories = pd.Index(values.unique()).difference(df[column].cat.categories)
+        if len(new_categories):
+            df[column] = df[column].cat.add_categories(new_categories)
+
+
+def apply_table_changes(tables: Dict, changes: Dict) -> None:
+    """
+    Patches the tables with the changes since their state version, see TableChanges of the backend.
+    :param tables: Tables of the previous state version, modified in place.
+    :param changes: Changes returned by the backend.
+    """
+    if changes["Beds"]:
+        changed_beds = pd.DataFrame(changes["Beds"]).set_index("bed_id")
+        beds = tables["Beds"].set_index("bed_id")
+        for column in changed_beds.columns:
+            add_categories(beds, column, changed_beds[column])
+            beds.loc[changed_beds.index, column] = changed_beds[column]
+        tables["Beds"] = beds.reset_index()
+
+    queue_changes = changes["PatientQueue"]
+    if queue_changes["Removed"] or queue_changes["Added"]:
+        queue = tables["PatientQueue"]
+        added = pd.DataFrame(queue_changes["Added"], columns=queue.columns)
+        kept = queue[~queue["place_in_queue"].isin(queue_changes["Removed"])]
+        places = pd.RangeIndex(1, len(kept) + len(added) + 1).difference(added["place_in_queue"])
+        kept = kept.assign(place_in_queue=places)
+        if len(added):
+            for column in kept.columns:
+                add_categories(kept, column, added[column])
+                if isinstance(kept[column].dtype, pd.CategoricalDtype):
+                    added[column] = added[column].astype(kept[column].dtype)
+            kept = pd.concat([kept, added]).sort_values("place_in_queue", kind="stable")
+        tables["PatientQueue"] = kept.reset_index(drop=True)
+
+    for name in ("NoShows", "ReplacementData"):
+        if changes[name] is not None:
+            tables[name] = changes[name]
+    for name, value in changes["Statistics"].items():
+        if isinstance(value, dict):
+            keep = value["Keep"]
+            series = tables["Statistics"][name]
+            tables["Statistics"][name] = {column: series[column][:keep] + value[column] for column in series}
+        else:
+            tables["Statistics"][name] = value
+
+
+def change_state(path: str, params: Dict) -> Dict:
+    """
+    Sends a request changing the simulation state and remembers the state version it resulted in, so the tables
+    are requested again only after the state changed.
+    :param path: Path of the backend endpoint.
+    :param params: Query parameters without the session id.
+    :return: Parsed JSON response.
+    """
+    st.session_state.state_version = None
+    response = requests.get(
+        f"http://backend:8000/{path}", params={**params, "session_id": st.session_state.session_id}, timeout=BACKEND_TIMEOUT
+    )
+    response.raise_for_status()
+    result = response.json()
+    st.session_state.state_version = result.get("version")
+    return result
+
+
 def get_list_of_tables_and_statistics() -> Optional[Dict]:
+    """
+    Patches the tables kept in the session with the changes since their state version. They are loaded whole on
+    the first run and when the backend no longer has the changes, beds and queue as Arrow tables, the rest as JSON.
+    Nothing is requested while the tables have the version of the last state change made by this session.
+    :return: Dictionary with Beds (with department names) and PatientQueue DataFrames, NoShows, Statistics
+        and ReplacementData.
+    """
+    if st.session_state.tables_version is not None and st.session_state.tables_version == st.session_state.state_version:
+        return st.session_state.tables
+
     try:
-        response = requests.get("http://backend:8000/get-tables-and-statistics")
-        if response.status_code == 200:
-            return response.json()
-        else:
+        params = {"session_id": st.session_state.session_id}
+        if st.session_state.tables_version is not None:
+            response = requests.get("http://backend:8000/changes", params={**params, "since": st.session_state.tables_version})
+            if response.status_code == 200:
+                changes = response.json()
+                apply_table_changes(st.session_state.tables, changes)
+                st.session_state.tables_version = st.session_state.state_version = changes["Version"]
+                return st.session_state.tables
+
+        beds, beds_version = get_backend_data("get-beds", params, ARROW_STREAM)
+        queue, queue_version = get_backend_data("get-queue", params, ARROW_STREAM)
+        other, other_version = get_backend_data(
+            "get-tables-and-statistics", {**params, "fields": "NoShows,Statistics,ReplacementData"}
+        )
+        if beds is None or queue is None or other is None:
             main_tab.error(_("Failed to fetch data from the server."))
             return None
+        st.session_state.tables = {
+            "Beds": arrow_table_to_dataframe(beds),
+            "PatientQueue": arrow_table_to_dataframe(queue),
+            **other,
+        }
+        # Tables loaded across a state change are loaded again on the next run.
+        st.session_state.tables_version = beds_version if beds_version == queue_version == other_version else None
+        st.session_state.state_version = st.session_state.tables_version
+        return st.session_state.tables
     except Exception as e:
         main_tab.error(f"{_('Failed to connect to the server')}: {e}")
         return None
@@ -543,8 +694,7 @@ def get_list_of_tables_and_statistics() -> Optional[Dict]:
 
 def update_day(delta: int) -> None:
     try:
-        response = requests.get("http://backend:8000/update-day", params={"delta": delta})
-        st.session_state.day_for_simulation = response.json()["day"]
+        st.session_state.day_for_simulation = change_state("update-day", {"delta": delta})["day"]
         st.session_state.pop("current_patient_index", None)
         st.session_state.pop("replacement_start_index", None)
         st.session_state.pop("phoned_ids", None)
@@ -567,8 +717,7 @@ def sort_values_for_charts_by_dates(data) -> pd.DataFrame:
 
 def reset_day_for_simulation() -> None:
     try:
-        response = requests.get("http://backend:8000/reset-simulation")
-        st.session_state.day_for_simulation = response.json()["day"]
+        st.session_state.day_for_simulation = change_state("reset-simulation", {})["day"]
         st.session_state.pop("current_patient_index", None)
         st.session_state.pop("replacement_start_index", None)
         st.session_state.pop("phoned_ids", None)
@@ -588,51 +737,47 @@ def find_next_patient_to_call(
     if additional_ids is None:
         additional_ids = []
 
-    def check_patient_admission_days(queue_df, patient_id, place_in_queue, days_of_stay) -> bool:
-        conflicts_df = queue_df[
-            (queue_df["place_in_queue"] != place_in_queue)
-            & (queue_df["patient_id"] == patient_id)
-            & (
-                queue_df["admission_day"].between(
-                    st.session_state.day_for_simulation,
-                    st.session_state.day_for_simulation + days_of_stay - 1,
-                    inclusive="both",
-                )
-            )
-        ].copy()
+    def get_places_during_stay(patient_ids, days_of_stay) -> dict[int, list[int]]:
+        if not patient_ids:
+            return {}
+        response = requests.get(
+            "http://backend:8000/get-patient-queue-entries",
+            params={"patient_id": patient_ids, "session_id": st.session_state.session_id},
+            timeout=BACKEND_TIMEOUT,
+        )
+        response.raise_for_status()
 
-        return conflicts_df.empty
+        last_day = st.session_state.day_for_simulation + days_of_stay - 1
+        places = {}
+        for entry in response.json():
+            if entry["admission_day"] <= last_day:
+                places.setdefault(entry["patient_id"], []).append(entry["place_in_queue"])
+        return places
 
-    def id_with_best_matching_personnel(df: pd.DataFrame, personnel: dict) -> int:
+    def sort_by_best_matching_personnel(df: pd.DataFrame, personnel: dict) -> pd.DataFrame:
         target_keys = set(personnel.keys())
 
         df["score"] = df["personnel"].map(lambda d: len(set(d.keys()) & target_keys))
         df["key_diff"] = df["personnel"].map(lambda d: abs(len(set(d.keys())) - len(target_keys)))
 
-        sorted_df = df.sort_values(by=["score", "key_diff", "place_in_queue"], ascending=[False, True, False])
-
-        return sorted_df.iloc[0]["place_in_queue"]
-
-    conflicting_patients = []
-    for index, row in queue_df.iterrows():
-        if (
-            not check_patient_admission_days(queue_df, row["patient_id"], row["place_in_queue"], days_of_stay)
-            and row["patient_id"] not in conflicting_patients
-        ):
-            conflicting_patients.append(row["patient_id"])
+        return df.sort_values(by=["score", "key_diff", "place_in_queue"], ascending=[False, True, False])
 
     queue_df = queue_df[
         (queue_df["department"] == department)
         & (queue_df["days_of_stay"] <= days_of_stay)
         & (~queue_df["place_in_queue"].isin(st.session_state.phoned_ids + additional_ids))
         & (~queue_df["patient_id"].isin(bed_df["patient_id"]))
-        & (~queue_df["patient_id"].isin(conflicting_patients))
     ]
 
-    if queue_df.empty:
-        return -1
+    sorted_df = sort_by_best_matching_personnel(queue_df.copy(), personnel)
+    places_during_stay = get_places_during_stay(
+        [int(patient_id) for patient_id in sorted_df["patient_id"].unique()], days_of_stay
+    )
+    for patient_id, place_in_queue in zip(sorted_df["patient_id"], sorted_df["place_in_queue"]):
+        if all(place == place_in_queue for place in places_during_stay.get(patient_id, [])):
+            return place_in_queue - 1
 
-    return id_with_best_matching_personnel(queue_df.copy(), personnel) - 1
+    return -1
 
 
 # endregion
@@ -646,16 +791,17 @@ elif st.session_state.button_pressed:
 bed_df, queue_df, no_shows_df = None, None, None
 tables = get_list_of_tables_and_statistics()
 if tables:
-    bed_df = pd.DataFrame(tables["AllBedAssignments"])
+    beds_with_departments_df = tables["Beds"]
+    bed_df = beds_with_departments_df.drop(columns="department")
     no_shows_df = pd.DataFrame(tables["NoShows"])
-    queue_df = pd.DataFrame(tables["PatientQueue"])
+    queue_df = tables["PatientQueue"]
     replacement_days_of_stay = tables["ReplacementData"]["DaysOfStay"]
     replacement_personnels = tables["ReplacementData"]["Personnels"]
     replacement_departments = tables["ReplacementData"]["Departments"]
-    bed_departments = tables["DepartmentAssignments"]
-
-    for department in bed_departments:
-        bed_departments[department] = pd.DataFrame(bed_departments[department])
+    bed_departments = {
+        department: df.drop(columns="department").reset_index(drop=True)
+        for department, df in beds_with_departments_df.groupby("department", sort=False, observed=True)
+    }
 
 replacement_index = st.session_state.get("replacement_start_index", 0)
 if "current_patient_index" not in st.session_state: